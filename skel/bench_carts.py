@@ -0,0 +1,48 @@
+"""
+This module measures how long consumers stay blocked per cart on the bundled
+tests, with carts run through the cart planner or strictly in order
+
+A cart is blocked from its creation until every product is reserved.
+
+Usage: python3 bench_carts.py [test numbers ...]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def blocked_times(test, strict, directory):
+    """
+    Runs test.py on one test and returns the blocked time of every cart
+    """
+    path = os.path.join(directory, 'blocked.json')
+    command = [sys.executable, 'test.py', os.path.join('tests', f"{test:02d}.in"),
+               '--blocked', path]
+    if strict:
+        command.append('--strict')
+    subprocess.run(command, stdout=subprocess.DEVNULL, check=True)
+    with open(path) as blocked_file:
+        return [time for times in json.load(blocked_file).values() for time in times]
+
+
+def main():
+    """
+        Prints the mean, maximum and total blocked time per cart of both
+        paths for every test
+    """
+    tests = [int(test) for test in sys.argv[1:]] or list(range(5, 11))
+
+    print(f"{'test':>4} {'carts':>5} {'path':>8} {'mean s':>8} {'max s':>8} {'total s':>8}")
+    with tempfile.TemporaryDirectory() as directory:
+        for test in tests:
+            for name, strict in (('planned', False), ('strict', True)):
+                times = blocked_times(test, strict, directory)
+                print(f"{test:4} {len(times):5} {name:>8} {sum(times) / len(times):8.3f} "
+                      f"{max(times):8.3f} {sum(times):8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+This module measures how many orders per second the marketplace places as
+the number of consumers grows, with every consumer calling place_order
+directly or submitting its orders to the group committer
+
+Usage: python3 bench_orders.py [orders_per_consumer] [consumers ...]
+"""
+
+import os
+import sys
+import tempfile
+from threading import Barrier, Thread
+from time import perf_counter
+
+from tema.marketplace import Marketplace
+from tema.product import Tea
+
+PRODUCT = Tea('Linden', 9, 'Herbal')
+
+
+def run_consumer(marketplace, producer_id, orders, group_commit, name, barrier):
+    """
+    Fills one-product carts and places them, printing the bought products
+    the way a Consumer does
+    """
+    carts = []
+    for _ in range(orders):
+        marketplace.publish(producer_id, PRODUCT)
+        cart_id = marketplace.new_cart()
+        marketplace.add_to_cart(cart_id, PRODUCT)
+        carts.append(cart_id)
+    barrier.wait()
+
+    if group_commit:
+        futures = [marketplace.submit_order(cart_id, name) for cart_id in carts]
+        for future in futures:
+            future.result()
+        return
+    result = []
+    for cart_id in carts:
+        result.extend(f"{name} bought {product}" for product in marketplace.place_order(cart_id))
+    with marketplace.lock_order:
+        print("\n".join(result))
+
+
+def measure(consumers, orders, group_commit):
+    """
+    Returns the orders placed per second by the given number of consumers
+    """
+    marketplace = Marketplace(0)
+    producer_id = marketplace.register_producer()
+    barrier = Barrier(consumers + 1)
+    threads = [Thread(target=run_consumer,
+                      args=(marketplace, producer_id, orders, group_commit, f"cons{index}",
+                            barrier))
+               for index in range(consumers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = perf_counter()
+    for thread in threads:
+        thread.join()
+    return consumers * orders / (perf_counter() - start)
+
+
+def main():
+    """
+        Prints the order throughput of both paths for every consumer count
+    """
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    counts = [int(count) for count in sys.argv[2:]] or [1, 2, 4, 8, 16]
+
+    # the bought lines go to a scratch file, like the output of test.py
+    stdout = sys.stdout
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'orders.out'), 'w') as output:
+            sys.stdout = output
+            try:
+                for consumers in counts:
+                    results.append((consumers, measure(consumers, orders, False),
+                                    measure(consumers, orders, True)))
+            finally:
+                sys.stdout = stdout
+
+    print(f"{'consumers':>9} {'place_order/s':>14} {'group commit/s':>15}")
+    for consumers, direct, grouped in results:
+        print(f"{consumers:9} {direct:14.0f} {grouped:15.0f}")
+
+
+if __name__ == '__main__':
+    main()
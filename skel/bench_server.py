@@ -0,0 +1,107 @@
+"""
+This module measures the round-trip latency and throughput of the marketplace
+server, over Unix and TCP sockets, against direct in-process calls
+
+Usage: python3 bench_server.py [operations] [batch_size ...]
+"""
+
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+from tema.client import MarketplaceClient
+from tema.marketplace import Marketplace
+from tema.product import Tea
+from tema.server import MarketplaceServer
+
+PRODUCT = Tea('Linden', 9, 'Herbal')
+
+
+def percentile(samples, fraction):
+    """
+    Returns the given percentile (0..1) of a list of samples
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def measure_latency(marketplace, operations):
+    """
+    Times each add_to_cart / remove_from_cart call on its own, waiting for
+    the answer before sending the next one
+    """
+    producer_id = marketplace.register_producer()
+    marketplace.publish(producer_id, PRODUCT)
+    cart_id = marketplace.new_cart()
+
+    samples = []
+    for _ in range(operations // 2):
+        start = perf_counter()
+        marketplace.add_to_cart(cart_id, PRODUCT)
+        middle = perf_counter()
+        marketplace.remove_from_cart(cart_id, PRODUCT)
+        end = perf_counter()
+        samples.extend((middle - start, end - middle))
+    return samples
+
+
+def measure_throughput(client, operations, batch_size):
+    """
+    Sends add_to_cart / remove_from_cart pairs in pipelined batches and
+    returns the number of operations per second
+    """
+    producer_id = client.register_producer()
+    client.publish(producer_id, PRODUCT)
+    cart_id = client.new_cart()
+
+    start = perf_counter()
+    sent = 0
+    while sent < operations:
+        with client.pipeline() as pipeline:
+            for _ in range(batch_size // 2 or 1):
+                pipeline.add_to_cart(cart_id, PRODUCT)
+                pipeline.remove_from_cart(cart_id, PRODUCT)
+        sent += len(pipeline.results)
+    return sent / (perf_counter() - start)
+
+
+def report(name, samples, throughputs):
+    """
+    Prints one line of latency percentiles followed by the throughput per batch size
+    """
+    print(f"{name:8} p50 {percentile(samples, 0.5) * 1e6:9.1f} us   "
+          f"p99 {percentile(samples, 0.99) * 1e6:9.1f} us   "
+          f"sequential {len(samples) / sum(samples):10.0f} ops/s")
+    for batch_size, throughput in throughputs:
+        print(f"{'':8} batch {batch_size:5}   {throughput:10.0f} ops/s")
+
+
+def main():
+    """
+        Runs the benchmark for in-process calls, a Unix socket and TCP
+    """
+    operations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_sizes = [int(size) for size in sys.argv[2:]] or [1, 16, 128]
+
+    report("local", measure_latency(Marketplace(0), operations), [])
+
+    with tempfile.TemporaryDirectory() as directory:
+        addresses = [("unix", os.path.join(directory, 'marketplace.sock')),
+                     ("tcp", "localhost:0")]
+        for name, address in addresses:
+            server = MarketplaceServer(Marketplace(0), address).start()
+            if name == "tcp":
+                host, port = server.server.server_address
+                address = f"{host}:{port}"
+            client = MarketplaceClient(address)
+            samples = measure_latency(client, operations)
+            throughputs = [(batch_size, measure_throughput(client, operations, batch_size))
+                           for batch_size in batch_sizes]
+            report(name, samples, throughputs)
+            client.close()
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
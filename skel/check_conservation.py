@@ -0,0 +1,444 @@
+"""
+This module checks that a recorded marketplace run neither lost nor
+duplicated stock. The trace written by test.py --record is mapped into
+NumPy arrays and processed in chunks, so it scales to very large traces
+
+For every (product, producer) the stock available must never go negative
+(a unit reserved twice), for every (cart, product) the reserved stock must
+never go negative, and at every checkpoint each product must satisfy
+published = available + reserved + sold against the observed stock
+
+Usage: python3 check_conservation.py TRACE [--chunk EVENTS] [--show N]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from time import perf_counter
+import tracemalloc
+import unittest
+
+import numpy as np
+
+from tema.protocol import PUBLISH, ADD_TO_CART, REMOVE_FROM_CART, PLACE_ORDER
+from tema.recorder import (EVENT, MAGIC, HEADER_LENGTH, ORDER_ITEM, SNAPSHOT, NESTED,
+                           PRODUCT_CLASSES, operation_name)
+
+EVENT_DTYPE = np.dtype([('seq', '<u8'), ('time', '<u8'), ('duration', '<u4'),
+                        ('thread', '<u2'), ('opcode', 'u1'), ('result', 'i1'),
+                        ('cart', '<i8'), ('producer', '<i4'), ('product', '<i4')])
+assert EVENT_DTYPE.itemsize == EVENT.size
+
+
+def map_trace(path):
+    """
+    Returns the trace header and a read-only memory map of its events
+    """
+    with open(path, 'rb') as trace_file:
+        if trace_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a marketplace trace")
+        header_length = HEADER_LENGTH.unpack(trace_file.read(HEADER_LENGTH.size))[0]
+        header = json.loads(trace_file.read(header_length).decode('utf-8'))
+    offset = len(MAGIC) + HEADER_LENGTH.size + header_length
+    events = np.memmap(path, dtype=EVENT_DTYPE, mode='r', offset=offset)
+    return header, events
+
+
+def grouped_running_sums(keys, deltas):
+    """
+    Stable-sorts the rows by key and returns, in sorted order, the row
+    permutation, the keys, the deltas, the running sum of the deltas inside
+    each key group, and the first row and size of every group
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    sorted_deltas = deltas[order]
+    running = np.cumsum(sorted_deltas, dtype=np.int64)
+    boundary = np.empty(len(keys), dtype=bool)
+    boundary[:1] = True
+    np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=boundary[1:])
+    starts = np.flatnonzero(boundary)
+    counts = np.diff(np.append(starts, len(keys)))
+    running -= np.repeat(running[starts] - sorted_deltas[starts], counts)
+    return order, sorted_keys, sorted_deltas, running, starts, counts
+
+
+def narrow(keys, limit):
+    """
+    Keys below 2^16 are sorted with a radix sort by NumPy
+    """
+    return keys.astype(np.uint16) if limit <= 1 << 16 else keys
+
+
+def crossed_below_zero(running, deltas):
+    """
+    Marks the rows whose delta took a running balance from >= 0 to < 0, so a
+    violation is reported once rather than on every later row of its group
+    """
+    return (running < 0) & (running - deltas >= 0)
+
+
+class ConservationChecker:
+    """
+    Accumulates the stock balances chunk by chunk and collects violations
+    """
+
+    def __init__(self, product_count, producer_count, show):
+        self.product_count = product_count
+        self.producer_count = producer_count
+        self.show = show
+        # dense balances carried between chunks
+        self.available = np.zeros(product_count * producer_count, dtype=np.int64)
+        # per product: published - sold, available and reserved
+        self.totals = np.zeros((3, product_count), dtype=np.int64)
+        # (cart, product) reserved balances still open at the end of a chunk
+        self.open_carts = np.zeros(0, dtype=np.int64)
+        self.open_products = np.zeros(0, dtype=np.int64)
+        self.open_reserved = np.zeros(0, dtype=np.int64)
+        self.violations = {}
+        self.examples = []
+        self.checkpoints = 0
+        # whether the previous chunk ended inside a run of snapshot rows
+        self.in_checkpoint = False
+
+    def flag(self, kind, events, positions):
+        """
+        Counts the violations of one kind and keeps a few examples
+        """
+        if len(positions) == 0:
+            return
+        self.violations[kind] = self.violations.get(kind, 0) + len(positions)
+        for position in positions[:max(0, self.show - len(self.examples))]:
+            self.examples.append((kind, events[position]))
+
+    def check_available(self, events, product, published, added, removed):
+        """
+        Running stock per (product, producer): publish and remove give units
+        back, add takes them; going below zero means a double reservation
+        """
+        rows = np.flatnonzero(published | added | removed)
+        if len(rows) == 0:
+            return
+        deltas = np.where(added[rows], -1, 1).astype(np.int8)
+        keys = narrow(product[rows].astype(np.int64) * self.producer_count
+                      + events['producer'][rows], len(self.available))
+        order, sorted_keys, sorted_deltas, running, starts, counts = \
+            grouped_running_sums(keys, deltas)
+        group_keys = sorted_keys[starts]
+        running += np.repeat(self.available[group_keys], counts)
+        self.flag("double reservation (stock below zero)", events,
+                  rows[order[crossed_below_zero(running, sorted_deltas)]])
+        self.available[group_keys] = running[starts + counts - 1]
+
+    def check_carts(self, events, product, added, removed, sold):
+        """
+        Running reserved stock per (cart, product): remove and order items
+        take units out of the cart and can never exceed what it reserved
+        """
+        rows = np.flatnonzero(added | removed | sold)
+
+        # balances left open by the previous chunk come first
+        carried = len(self.open_carts)
+        carts = np.concatenate([self.open_carts, events['cart'][rows]])
+        products = np.concatenate([self.open_products, product[rows]])
+        deltas = np.concatenate([self.open_reserved, np.where(added[rows], 1, -1)])
+        if len(deltas) == 0:
+            return
+        if carts.max() < (1 << 62) // self.product_count:
+            cart_index = None
+            keys = carts * self.product_count + products
+        else:
+            cart_index, cart_keys = np.unique(carts, return_inverse=True)
+            keys = cart_keys.astype(np.int64) * self.product_count + products
+        order, sorted_keys, sorted_deltas, running, starts, counts = \
+            grouped_running_sums(keys, deltas)
+        negative = order[crossed_below_zero(running, sorted_deltas)]
+        self.flag("cart reserved stock below zero", events,
+                  rows[negative[negative >= carried] - carried])
+
+        ends = starts + counts - 1
+        still_open = running[ends] != 0
+        open_keys = sorted_keys[ends][still_open]
+        open_carts = open_keys // self.product_count
+        self.open_carts = open_carts if cart_index is None else cart_index[open_carts]
+        self.open_products = open_keys % self.product_count
+        self.open_reserved = running[ends][still_open]
+
+    def check_checkpoints(self, events, product, published, added, removed, sold, snapshot):
+        """
+        Per product published - sold must equal the observed available plus
+        reserved stock at each checkpoint; available and reserved are also
+        compared on their own to point at the side that drifted
+        """
+        # a checkpoint is a run of consecutive snapshot rows, one per product;
+        # the rows between two checkpoints form a segment, and per segment
+        # and product totals, accumulated over segments, give the derived
+        # stock at every checkpoint without a running sum over every event
+        previous = np.empty(len(snapshot), dtype=bool)
+        previous[:1] = self.in_checkpoint
+        previous[1:] = snapshot[:-1]
+        if len(snapshot):
+            self.in_checkpoint = bool(snapshot[-1])
+        segment = np.cumsum(snapshot & ~previous)
+        checkpoints = int(segment[-1]) if len(segment) else 0
+        snapshots = np.flatnonzero(snapshot)
+        rows = np.flatnonzero(published | added | removed | sold)
+        cells = (checkpoints + 1) * self.product_count
+        keys = segment[rows] * self.product_count + product[rows]
+        # totals[:, k] holds the balances after the first k segments, with
+        # k = 0 the balances carried from the previous chunk
+        totals = np.empty((3, checkpoints + 2, self.product_count), dtype=np.int64)
+        totals[:, 0] = self.totals
+        for column, weights in enumerate([published[rows].astype(np.int8) - sold[rows],
+                                          np.where(added[rows], -1, 1) * ~sold[rows],
+                                          np.where(added[rows], 1, -1) * ~published[rows]]):
+            totals[column, 1:] = np.bincount(keys, weights=weights, minlength=cells) \
+                .round().astype(np.int64).reshape(checkpoints + 1, self.product_count)
+        np.cumsum(totals, axis=1, out=totals)
+        self.totals = totals[:, -1, :].copy()
+        if len(snapshots) == 0:
+            return
+
+        # a snapshot row of the k-th checkpoint of the chunk sees the first k
+        # segments; rows continuing a checkpoint from the previous chunk
+        # have k = 0
+        self.checkpoints += len(snapshots)
+        snapshot_products = product[snapshots]
+        derived = totals[:, segment[snapshots], snapshot_products]
+        observed_available = events['producer'][snapshots].astype(np.int64)
+        observed_reserved = events['cart'][snapshots]
+        self.flag("published != available + reserved + sold", events,
+                  snapshots[derived[0] != observed_available + observed_reserved])
+        self.flag("available stock differs from events", events,
+                  snapshots[derived[1] != observed_available])
+        self.flag("reserved stock differs from events", events,
+                  snapshots[derived[2] != observed_reserved])
+
+    def check(self, events):
+        """
+        Classifies the events of one chunk once and runs every check on it
+        """
+        opcode = events['opcode'] & ~np.uint8(NESTED)
+        product = events['product'].astype(np.int64)
+        published = (opcode == PUBLISH) & (events['result'] == 1)
+        added = (opcode == ADD_TO_CART) & (events['result'] == 1)
+        removed = (opcode == REMOVE_FROM_CART) & (events['producer'] >= 0)
+        sold = opcode == ORDER_ITEM
+        snapshot = opcode == SNAPSHOT
+        self.check_available(events, product, published, added, removed)
+        self.check_carts(events, product, added, removed, sold)
+        self.check_checkpoints(events, product, published, added, removed, sold, snapshot)
+
+
+def check_trace(path, chunk, show):
+    """
+    Checks a trace file chunk by chunk and returns its header, its events
+    and the checker holding the violations
+    """
+    header, events = map_trace(path)
+    producer_count = 1
+    for offset in range(0, len(events), chunk):
+        chunk_events = events[offset:offset + chunk]
+        publishes = chunk_events['producer'][chunk_events['opcode'] == PUBLISH]
+        producer_count = max(producer_count, int(publishes.max(initial=0)) + 1)
+    checker = ConservationChecker(max(len(header['products']), 1), producer_count, show)
+    for offset in range(0, len(events), chunk):
+        checker.check(np.asarray(events[offset:offset + chunk]))
+    return header, events, checker
+
+
+def main():
+    """
+        Maps the trace, checks it chunk by chunk and prints the violations
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', help="trace file written by test.py --record")
+    parser.add_argument('--chunk', type=int, default=1 << 24, help="events per chunk")
+    parser.add_argument('--show', type=int, default=10, help="examples to print")
+    arguments = parser.parse_args()
+
+    start = perf_counter()
+    header, events, checker = check_trace(arguments.trace, arguments.chunk, arguments.show)
+    elapsed = perf_counter() - start
+
+    products = [PRODUCT_CLASSES[description.pop('product_type')](**description)
+                for description in header['products']]
+    print(f"{len(events)} events, {checker.checkpoints} product checkpoints, "
+          f"checked in {elapsed:.2f}s")
+    for kind, count in checker.violations.items():
+        print(f"  {count:10} x {kind}")
+    for kind, event in checker.examples:
+        product = products[event['product']] if 0 <= event['product'] < len(products) else None
+        print(f"  seq {event['seq']}: {kind}: {operation_name(int(event['opcode']))} "
+              f"cart {event['cart']} producer {event['producer']} {product}")
+    if checker.violations:
+        sys.exit(1)
+    print("stock conserved")
+
+
+# Tests for the conservation checker
+
+DOUBLE_RESERVATION = "double reservation (stock below zero)"
+CART_BELOW_ZERO = "cart reserved stock below zero"
+CHECKPOINT_MISMATCH = "published != available + reserved + sold"
+AVAILABLE_DRIFT = "available stock differs from events"
+RESERVED_DRIFT = "reserved stock differs from events"
+
+
+def build_events(rows):
+    """
+    Builds trace events from (opcode, result, cart, producer, product) rows
+    """
+    events = np.zeros(len(rows), dtype=EVENT_DTYPE)
+    for seq, (opcode, result, cart, producer, product) in enumerate(rows):
+        events[seq] = (seq, seq, 0, 0, opcode, result, cart, producer, product)
+    return events
+
+
+def write_trace(path, events, product_count):
+    """
+    Writes events to a trace file in the format of Recorder.dump
+    """
+    header = json.dumps({
+        'products': [{'product_type': 'Product', 'name': f'product{index}', 'price': index}
+                     for index in range(product_count)],
+        'threads': ['MainThread'],
+    }).encode('utf-8')
+    with open(path, 'wb') as trace_file:
+        trace_file.write(MAGIC)
+        trace_file.write(HEADER_LENGTH.pack(len(header)))
+        trace_file.write(header)
+        trace_file.write(events.tobytes())
+
+
+def publish(producer, product):
+    """
+    A published unit
+    """
+    return (PUBLISH, 1, 0, producer, product)
+
+
+def add(cart, producer, product, result=1):
+    """
+    An add_to_cart of one unit
+    """
+    return (ADD_TO_CART, result, cart, producer, product)
+
+
+def remove(cart, producer, product):
+    """
+    A remove_from_cart that gave one unit back to its producer
+    """
+    return (REMOVE_FROM_CART, -1, cart, producer, product)
+
+
+def sold(cart, product):
+    """
+    A product sold by place_order
+    """
+    return (ORDER_ITEM, 1, cart, -1, product)
+
+
+def snapshot(product, available, reserved):
+    """
+    A checkpoint row of one product
+    """
+    return (SNAPSHOT, -1, reserved, available, product)
+
+
+class TestConservationChecker(unittest.TestCase):
+    """
+    Runs the checker on small traces with known violations
+    """
+
+    def check(self, rows, product_count=2, producer_count=2, chunk=None):
+        """
+        Returns the violations found in rows, checked in chunks of chunk events
+        """
+        events = build_events(rows)
+        checker = ConservationChecker(product_count, producer_count, 10)
+        chunk = chunk or len(events)
+        for offset in range(0, len(events), chunk):
+            checker.check(events[offset:offset + chunk])
+        return checker.violations
+
+    def test_clean_trace(self):
+        rows = [publish(0, 0), publish(0, 0), publish(1, 1),
+                add(7, 0, 0), add(7, 0, 0), add(7, 1, 1), remove(7, 0, 0),
+                add(8, 0, 0, result=0),
+                (PLACE_ORDER, -1, 7, 2, -1), sold(7, 0), sold(7, 1),
+                snapshot(0, 1, 0), snapshot(1, 0, 0)]
+        self.assertEqual(self.check(rows), {})
+
+    def test_double_reservation(self):
+        rows = [publish(0, 0), add(7, 0, 0), add(8, 0, 0), add(9, 0, 0), publish(0, 1)]
+        # reported once, when the balance first drops below zero
+        self.assertEqual(self.check(rows), {DOUBLE_RESERVATION: 1})
+
+    def test_negative_cart_balance(self):
+        rows = [publish(0, 0), add(7, 0, 0), sold(7, 0), remove(7, 0, 0)]
+        self.assertEqual(self.check(rows), {CART_BELOW_ZERO: 1})
+
+    def test_checkpoint_mismatch(self):
+        rows = [publish(0, 0), publish(0, 0), publish(1, 1), add(7, 1, 1),
+                snapshot(0, 1, 0), snapshot(1, 0, 1)]
+        self.assertEqual(self.check(rows), {CHECKPOINT_MISMATCH: 1, AVAILABLE_DRIFT: 1})
+
+        rows[-1] = snapshot(1, 0, 0)
+        rows[-2] = snapshot(0, 2, 0)
+        self.assertEqual(self.check(rows), {CHECKPOINT_MISMATCH: 1, RESERVED_DRIFT: 1})
+
+    def test_chunked_trace(self):
+        rows = [publish(0, 0), add(7, 0, 0), publish(1, 1), add(7, 1, 1),
+                remove(7, 0, 0), add(8, 0, 0), add(9, 0, 0),
+                snapshot(0, 0, 1), sold(7, 1), sold(7, 1), sold(8, 0),
+                snapshot(0, 0, 0), snapshot(1, 0, 0)]
+        # product 0 is reserved twice (carts 8 and 9), so both of its
+        # checkpoints also see available -1 and one extra reserved unit;
+        # product 1 is sold twice from cart 7, which breaks the final checkpoint
+        expected = {DOUBLE_RESERVATION: 1, CART_BELOW_ZERO: 1, CHECKPOINT_MISMATCH: 1,
+                    AVAILABLE_DRIFT: 2, RESERVED_DRIFT: 3}
+        self.assertEqual(self.check(rows), expected)
+        # balances carried between chunks give the same result for any split
+        for chunk in range(1, len(rows)):
+            self.assertEqual(self.check(rows, chunk=chunk), expected)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.bin')
+            write_trace(path, build_events(rows), 2)
+            _, events, checker = check_trace(path, 3, 10)
+        self.assertEqual(len(events), len(rows))
+        self.assertEqual(checker.violations, expected)
+        self.assertEqual(checker.checkpoints, 3)
+        self.assertEqual(sorted(event['seq'] for kind, event in checker.examples
+                                if kind in (DOUBLE_RESERVATION, CART_BELOW_ZERO)), [6, 9])
+
+    def test_checkpoints_over_many_products(self):
+        # one checkpoint has a row per product; its memory must grow with
+        # checkpoints x products, not with the square of the snapshot rows
+        product_count = 5000
+        rows = [publish(0, product) for product in range(product_count)]
+        rows += [snapshot(product, 1, 0) for product in range(product_count)]
+        rows += [add(7, 0, 0)]
+        rows += [snapshot(product, 1, 0) for product in range(product_count)]
+        events = build_events(rows)
+
+        tracemalloc.start()
+        try:
+            checker = ConservationChecker(product_count, 1, 10)
+            for offset in range(0, len(events), 4096):
+                checker.check(events[offset:offset + 4096])
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(checker.checkpoints, 2 * product_count)
+        # product 0 was reserved after the first checkpoint, which the
+        # second one does not show: its total still matches, its sides do not
+        self.assertEqual(checker.violations, {AVAILABLE_DRIFT: 1, RESERVED_DRIFT: 1})
+        self.assertLess(peak, 16 << 20)
+
+
+if __name__ == '__main__':
+    main()
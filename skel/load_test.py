@@ -0,0 +1,257 @@
+"""
+This module drives the marketplace with an open-loop load: carts arrive
+from a Poisson or bursty process at a target rate, independently of how
+fast earlier carts complete. The rate is swept upwards until the
+marketplace saturates and the knee point is reported per configuration
+
+Usage: python3 load_test.py [--engine module:Class ...] [--via local|unix|tcp ...]
+                            [--arrivals poisson|bursty] [--start-rate R] ...
+"""
+
+import argparse
+import importlib
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test-gen'))
+
+# pylint: disable=wrong-import-position
+from test_generator import generate_products
+from tema import product as product_module
+from tema.client import MarketplaceClient
+from tema.server import MarketplaceServer
+
+
+def build_products(count, seed):
+    """
+    Builds the product objects for the same product mix the test generator uses
+    """
+    random.seed(seed)
+    products = []
+    for description in generate_products(count).values():
+        params = {k: v for k, v in description.items() if k not in ('product_type', 'is_produced')}
+        products.append(getattr(product_module, description['product_type'])(**params))
+    return products
+
+
+def arrival_times(rate, duration, process, rng, burst_period=0.2, on_fraction=0.25):
+    """
+    Returns the arrival offsets (seconds) of one sweep step. A bursty process
+    alternates between bursts at rate / on_fraction and silence, keeping the
+    same mean rate as the Poisson process
+    """
+    arrivals = []
+    now = 0.0
+    while True:
+        if process == 'poisson':
+            now += rng.expovariate(rate)
+        else:
+            now += rng.expovariate(rate / on_fraction)
+            phase = now % burst_period
+            if phase > burst_period * on_fraction:
+                now += burst_period - phase
+        if now >= duration:
+            return arrivals
+        arrivals.append(now)
+
+
+def random_cart(products, rng, max_operations, max_quantity):
+    """
+    Picks a few distinct products with their quantities
+    """
+    chosen = rng.sample(products, rng.randint(1, min(max_operations, len(products))))
+    return [(product, rng.randint(1, max_quantity)) for product in chosen]
+
+
+def run_cart(marketplace, identifier_producer, cart, scheduled, retry_wait_time):
+    """
+    Publishes the units a cart needs, fills the cart and places the order,
+    waiting retry_wait_time after a failed add like a Consumer does.
+    Returns the time from the scheduled arrival to the placed order
+    """
+    for product, quantity in cart:
+        for _ in range(quantity):
+            marketplace.publish(identifier_producer, product)
+    identifier_cart = marketplace.new_cart()
+    for product, quantity in cart:
+        added = 0
+        while added < quantity:
+            if marketplace.add_to_cart(identifier_cart, product):
+                added += 1
+            else:
+                sleep(retry_wait_time)
+    marketplace.place_order(identifier_cart)
+    return perf_counter() - scheduled
+
+
+def run_step(marketplace, identifier_producer, products, rate, arguments, rng):
+    """
+    Offers one rate for arguments.step seconds and returns the offered and
+    achieved throughput and the latency percentiles. The offered throughput
+    is the number of arrivals actually generated, not the nominal rate
+    """
+    offsets = arrival_times(rate, arguments.step, arguments.arrivals, rng)
+    carts = [random_cart(products, rng, arguments.max_operations, arguments.max_quantity)
+             for _ in offsets]
+    latencies = []
+    futures = []
+
+    with ThreadPoolExecutor(max_workers=arguments.workers) as executor:
+        start = perf_counter()
+
+        def generate():
+            for offset, cart in zip(offsets, carts):
+                scheduled = start + offset
+                delay = scheduled - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+                futures.append(executor.submit(run_cart, marketplace, identifier_producer,
+                                               cart, scheduled, arguments.retry_wait))
+
+        generator = Thread(target=generate)
+        generator.start()
+        generator.join()
+        for future in futures:
+            latencies.append(future.result())
+        elapsed = perf_counter() - start
+
+    latencies.sort()
+    offered = len(offsets) / arguments.step
+    if not latencies:
+        return offered, 0.0, 0.0, 0.0
+    return (offered, len(latencies) / max(elapsed, arguments.step),
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))])
+
+
+def open_marketplace(engine, via, directory):
+    """
+    Builds the engine and, for unix / tcp, serves it and returns a client.
+    Returns the marketplace to drive and the server to stop afterwards
+    """
+    module_name, _, class_name = engine.partition(':')
+    marketplace = getattr(importlib.import_module(module_name), class_name or 'Marketplace')(0)
+    if via == 'local':
+        return marketplace, None
+    address = os.path.join(directory, 'marketplace.sock') if via == 'unix' else 'localhost:0'
+    server = MarketplaceServer(marketplace, address).start()
+    if via == 'tcp':
+        host, port = server.server.server_address
+        address = f"{host}:{port}"
+    return MarketplaceClient(address), server
+
+
+def saturated(step, steps, arguments):
+    """
+    Returns 'throughput' when the achieved throughput falls behind the
+    arrivals actually offered, 'latency' when the p99 latency exceeds
+    knee-factor times the baseline (the median p99 of the first
+    arguments.baseline_steps steps), and None otherwise
+    """
+    _, offered, throughput, _, p99 = step
+    if throughput < arguments.saturation * offered:
+        return 'throughput'
+    baseline_p99 = statistics.median(previous[4] for previous in steps[:arguments.baseline_steps])
+    if len(steps) >= arguments.baseline_steps and p99 > arguments.knee_factor * baseline_p99:
+        return 'latency'
+    return None
+
+
+def sweep(marketplace, products, arguments):
+    """
+    Raises the offered rate until the marketplace saturates and returns the
+    measured steps and the knee step. A warm-up step at the starting rate is
+    discarded, and a step saturated only by its p99 is measured once more,
+    so a single latency outlier does not end the sweep
+    """
+    rng = random.Random(arguments.seed)
+    identifier_producer = marketplace.register_producer()
+    run_step(marketplace, identifier_producer, products, arguments.start_rate, arguments, rng)
+    steps = []
+    knee = None
+    rate = arguments.start_rate
+    while rate <= arguments.max_rate:
+        for attempt in range(2):
+            step = (rate,) + run_step(marketplace, identifier_producer, products,
+                                      rate, arguments, rng)
+            _, offered, throughput, p50, p99 = step
+            print(f"  rate {rate:10.1f}/s  offered {offered:10.1f}/s  "
+                  f"achieved {throughput:10.1f}/s  "
+                  f"p50 {p50 * 1000:9.2f} ms  p99 {p99 * 1000:9.2f} ms")
+            reason = saturated(step, steps + [step], arguments)
+            if reason != 'latency' or attempt:
+                break
+            print("  p99 above the knee threshold, measuring the step again")
+        steps.append(step)
+        if reason is not None:
+            print(f"  saturated ({reason})")
+            break
+        knee = step
+        rate *= arguments.factor
+    return steps, knee
+
+
+def main():
+    """
+        Sweeps every engine / transport configuration and prints the knee points
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', action='append',
+                        help="marketplace implementation, as module:Class")
+    parser.add_argument('--via', action='append', choices=['local', 'unix', 'tcp'])
+    parser.add_argument('--arrivals', choices=['poisson', 'bursty'], default='poisson')
+    parser.add_argument('--start-rate', type=float, default=50.0)
+    parser.add_argument('--factor', type=float, default=1.5)
+    parser.add_argument('--max-rate', type=float, default=100000.0)
+    parser.add_argument('--step', type=float, default=2.0, help="seconds per rate step")
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--products', type=int, default=10)
+    parser.add_argument('--max-operations', type=int, default=3)
+    parser.add_argument('--max-quantity', type=int, default=3)
+    parser.add_argument('--saturation', type=float, default=0.9,
+                        help="saturated once throughput < saturation * offered arrivals")
+    parser.add_argument('--knee-factor', type=float, default=10.0,
+                        help="saturated once p99 > knee-factor * baseline p99")
+    parser.add_argument('--baseline-steps', type=int, default=3,
+                        help="steps whose median p99 is the latency baseline")
+    parser.add_argument('--retry-wait', type=float, default=0.001,
+                        help="seconds to wait after a failed add_to_cart")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log', action='store_true', help="keep the marketplace.log logging")
+    arguments = parser.parse_args()
+
+    if not arguments.log:
+        logging.disable(logging.CRITICAL)
+    products = build_products(arguments.products, arguments.seed)
+
+    knees = []
+    with tempfile.TemporaryDirectory() as directory:
+        for engine in arguments.engine or ['tema.marketplace:Marketplace']:
+            for via in arguments.via or ['local']:
+                print(f"{engine} via {via} ({arguments.arrivals} arrivals)")
+                marketplace, server = open_marketplace(engine, via, directory)
+                _, knee = sweep(marketplace, products, arguments)
+                knees.append((engine, via, knee))
+                if server is not None:
+                    marketplace.close()
+                    server.stop()
+
+    print("\nknee points")
+    for engine, via, knee in knees:
+        if knee is None:
+            print(f"  {engine} via {via}: saturated at the starting rate")
+        else:
+            _, offered, throughput, _, p99 = knee
+            print(f"  {engine} via {via}: {offered:.1f} carts/s offered, "
+                  f"{throughput:.1f} carts/s achieved, p99 {p99 * 1000:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
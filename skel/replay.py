@@ -0,0 +1,172 @@
+"""
+This module replays a marketplace trace recorded with test.py --record
+against any Marketplace implementation
+
+Usage: python3 replay.py TRACE [--engine module:Class] [--address ADDRESS]
+                         [--interleaved] [--queue-size N]
+"""
+
+import argparse
+import importlib
+import logging
+from threading import Event, Thread
+from time import perf_counter_ns
+
+from tema.client import MarketplaceClient
+from tema.protocol import (REGISTER_PRODUCER, PUBLISH, NEW_CART, ADD_TO_CART,
+                           REMOVE_FROM_CART, PLACE_ORDER, ABANDON_CART,
+                           ADD_CHEAPEST_TO_CART)
+from tema.recorder import load_trace, replayable, operation_name
+
+
+class Replayer:
+    """
+    Re-drives recorded events against a marketplace, translating the recorded
+    producer and cart ids into the ones handed out by the replayed engine
+    """
+
+    def __init__(self, marketplace, products):
+        self.marketplace = marketplace
+        self.products = products
+        self.producers = {}
+        self.carts = {}
+        self.mismatches = 0
+
+    def execute(self, event):
+        """
+        Runs one event and returns its duration in nanoseconds
+        """
+        _, _, _, _, opcode, outcome, cart, producer, product_index = event
+        product = self.products[product_index] if product_index >= 0 else None
+        marketplace = self.marketplace
+        start = perf_counter_ns()
+        if opcode == REGISTER_PRODUCER:
+            self.producers[producer] = marketplace.register_producer()
+            result = None
+        elif opcode == PUBLISH:
+            result = marketplace.publish(self.producers[producer], product)
+        elif opcode == NEW_CART:
+            self.carts[cart] = marketplace.new_cart()
+            result = None
+        elif opcode == ADD_TO_CART:
+            result = marketplace.add_to_cart(self.carts[cart], product)
+        elif opcode == REMOVE_FROM_CART:
+            result = marketplace.remove_from_cart(self.carts[cart], product)
+        elif opcode == PLACE_ORDER:
+            result = len(marketplace.place_order(self.carts.pop(cart)))
+        elif opcode == ABANDON_CART:
+            result = marketplace.abandon_cart(self.carts.pop(cart))
+        elif opcode == ADD_CHEAPEST_TO_CART:
+            # the recorded run already resolved the query to a product
+            result = product is not None and marketplace.add_to_cart(self.carts[cart], product)
+        else:
+            return 0
+        duration = perf_counter_ns() - start
+
+        # the replayed engine must reach the same outcome as the recorded run
+        if opcode == PLACE_ORDER:
+            expected = producer
+        else:
+            expected = bool(outcome) if outcome >= 0 else None
+        if isinstance(result, bool) or opcode == PLACE_ORDER:
+            if result != expected:
+                self.mismatches += 1
+        return duration
+
+    def replay_sequential(self, events):
+        """
+        Replays all events on the calling thread, in recorded order
+        """
+        return [self.execute(event) for event in events]
+
+    def replay_interleaved(self, events, thread_count):
+        """
+        Replays every recorded thread on its own thread, passing a baton so
+        that the events still run in the exact recorded order
+        """
+        durations = [0] * len(events)
+        if not events:
+            return durations
+        ready = [Event() for _ in range(thread_count)]
+        owners = [event[3] for event in events]
+        positions = [[] for _ in range(thread_count)]
+        for position, owner in enumerate(owners):
+            positions[owner].append(position)
+
+        def run(thread_index):
+            for position in positions[thread_index]:
+                ready[thread_index].wait()
+                ready[thread_index].clear()
+                durations[position] = self.execute(events[position])
+                if position + 1 < len(events):
+                    ready[owners[position + 1]].set()
+
+        threads = [Thread(target=run, args=(thread_index,)) for thread_index in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        ready[owners[0]].set()
+        for thread in threads:
+            thread.join()
+        return durations
+
+
+def load_engine(spec, queue_size):
+    """
+    Builds a marketplace from a module:Class specification
+    """
+    module_name, _, class_name = spec.partition(':')
+    engine = getattr(importlib.import_module(module_name), class_name or 'Marketplace')
+    return engine(queue_size)
+
+
+def report(events, durations, elapsed):
+    """
+    Prints, per operation, the recorded and replayed mean latency
+    """
+    totals = {}
+    for event, duration in zip(events, durations):
+        count, recorded, replayed = totals.get(event[4], (0, 0, 0))
+        totals[event[4]] = (count + 1, recorded + event[2], replayed + duration)
+
+    print(f"{'operation':18} {'count':>9} {'recorded us':>12} {'replayed us':>12}")
+    for opcode in sorted(totals):
+        count, recorded, replayed = totals[opcode]
+        print(f"{operation_name(opcode):18} {count:9} "
+              f"{recorded / count / 1000:12.2f} {replayed / count / 1000:12.2f}")
+    print(f"{len(events)} events replayed in {elapsed / 1e9:.3f}s")
+
+
+def main():
+    """
+        Loads the trace, builds the target marketplace and replays the trace
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', help="trace file written by test.py --record")
+    parser.add_argument('--engine', default='tema.marketplace:Marketplace',
+                        help="marketplace implementation, as module:Class")
+    parser.add_argument('--address', help="replay against a marketplace server instead")
+    parser.add_argument('--interleaved', action='store_true',
+                        help="replay each recorded thread on its own thread")
+    parser.add_argument('--queue-size', type=int, default=0)
+    arguments = parser.parse_args()
+
+    header, events = load_trace(arguments.trace)
+    events = replayable(events)
+    if arguments.address:
+        marketplace = MarketplaceClient(arguments.address)
+    else:
+        logging.disable(logging.CRITICAL)
+        marketplace = load_engine(arguments.engine, arguments.queue_size)
+
+    replayer = Replayer(marketplace, header['products'])
+    start = perf_counter_ns()
+    if arguments.interleaved:
+        durations = replayer.replay_interleaved(events, len(header['threads']))
+    else:
+        durations = replayer.replay_sequential(events)
+    report(events, durations, perf_counter_ns() - start)
+    print(f"{replayer.mismatches} outcomes differ from the recorded run")
+
+
+if __name__ == '__main__':
+    main()
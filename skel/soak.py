@@ -0,0 +1,70 @@
+"""
+This module runs a long cart lifecycle soak against the marketplace and
+tracks the process RSS over time
+
+Usage: python3 soak.py [carts] [samples]
+"""
+
+import logging
+import os
+import resource
+import sys
+from time import perf_counter
+
+from tema.marketplace import Marketplace
+from tema.product import Tea, Coffee
+
+PRODUCTS = [Tea('Linden', 9, 'Herbal'), Coffee('Arabica', 10, 5.05, 'MEDIUM')]
+
+
+def current_rss():
+    """
+    Returns the resident set size of the process in KiB
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    """
+        Creates carts in a loop: every cart reserves products and is then
+        either ordered or abandoned (one in four), so both release paths run
+    """
+    carts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    # one log line per operation would dominate the run (and the disk)
+    logging.disable(logging.CRITICAL)
+
+    marketplace = Marketplace(0)
+    producer_id = marketplace.register_producer()
+    interval = max(1, carts // samples)
+
+    print(f"{'carts':>12} {'rss KiB':>10} {'carts/s':>10}")
+    start = last = perf_counter()
+    for index in range(carts):
+        identifier_cart = marketplace.new_cart()
+        for product in PRODUCTS:
+            # abandoned carts give their units back, so only restock when empty
+            if not marketplace.add_to_cart(identifier_cart, product):
+                marketplace.publish(producer_id, product)
+                marketplace.add_to_cart(identifier_cart, product)
+        if index % 4 == 3:
+            marketplace.abandon_cart(identifier_cart)
+        else:
+            marketplace.place_order(identifier_cart)
+
+        if (index + 1) % interval == 0:
+            now = perf_counter()
+            print(f"{index + 1:12} {current_rss():10} {interval / (now - last):10.0f}")
+            last = now
+
+    print(f"{carts} carts in {perf_counter() - start:.1f}s, "
+          f"{len(marketplace.database['reserved_products'])} cart slots allocated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+from bisect import bisect_left, insort
+from dataclasses import fields, is_dataclass
+from itertools import combinations
+import unittest
+
+from tema.product import Product, Tea, Coffee
+
+#Campurile dupa care nu se construiesc indexuri: pretul este chiar cheia
+#de sortare a fiecarui index
+SORT_FIELD = 'price'
+
+
+class Catalog:
+
+    def __init__(self):
+
+        #Pentru fiecare produs tinem numarul de unitati disponibile. Un produs
+        #cu cel putin o unitate disponibila apare in indexurile secundare:
+        #cate o lista sortata dupa (pret, id produs) pentru fiecare clasa din
+        #ierarhia produsului si fiecare combinatie de atribute ale clasei.
+        #Astfel orice interogare este o cautare exacta a indexului urmata de
+        #o cautare binara dupa pret
+        self.available = {}
+        self.product_ids = {}
+        self.products = []
+        self.product_classes = {product_class.__name__: product_class
+                                for product_class in [Product, Tea, Coffee]}
+        self.indexes = {}
+
+    def index_keys(self, product):
+
+        keys = []
+        for product_class in type(product).__mro__:
+            if not is_dataclass(product_class) or not issubclass(product_class, Product):
+                continue
+            self.product_classes.setdefault(product_class.__name__, product_class)
+            attributes = [(field.name, getattr(product, field.name))
+                          for field in fields(product_class) if field.name != SORT_FIELD]
+            for size in range(len(attributes) + 1):
+                for subset in combinations(sorted(attributes), size):
+                    keys.append((product_class, subset))
+        return keys
+
+    def add(self, product):
+
+        #O unitate in plus; daca produsul tocmai a redevenit disponibil,
+        #il adaugam in toate indexurile lui
+        count = self.available.get(product, 0)
+        self.available[product] = count + 1
+        if count == 0:
+            entry = (product.price, self.product_id(product))
+            for key in self.index_keys(product):
+                insort(self.indexes.setdefault(key, []), entry)
+
+    def remove(self, product):
+
+        #O unitate in minus; la ultima unitate produsul iese din indexuri
+        count = self.available.get(product, 0)
+        if count <= 1:
+            self.available.pop(product, None)
+            if count == 1:
+                entry = (product.price, self.product_id(product))
+                for key in self.index_keys(product):
+                    index = self.indexes[key]
+                    del index[bisect_left(index, entry)]
+        else:
+            self.available[product] = count - 1
+
+    def product_id(self, product):
+
+        product_id = self.product_ids.get(product)
+        if product_id is None:
+            product_id = len(self.products)
+            self.products.append(product)
+            self.product_ids[product] = product_id
+        return product_id
+
+    def parse_query(self, query):
+
+        #Interogarea este un dictionar de forma celor din fisierele de test:
+        #{"product_type": "Tea", "type": "Oolong", "max_price": 5}; lipsa
+        #product_type inseamna orice produs. Intoarce cheia indexului si
+        #limitele de pret; o clasa sau un atribut necunoscut arunca ValueError,
+        #pentru ca o astfel de interogare nu ar putea fi satisfacuta niciodata
+        attributes = dict(query)
+        product_type = attributes.pop('product_type', 'Product')
+        product_class = self.product_classes.get(product_type)
+        min_price = attributes.pop('min_price', None)
+        max_price = attributes.pop('max_price', None)
+        if product_class is None:
+            raise ValueError(f"Unknown product_type {product_type!r}")
+        names = {field.name for field in fields(product_class)}
+        if not set(attributes) <= names - {SORT_FIELD}:
+            raise ValueError(f"Unknown attributes for {product_class.__name__}: "
+                             f"{sorted(set(attributes) - names)}")
+        return (product_class, tuple(sorted(attributes.items()))), min_price, max_price
+
+    def cheapest(self, query):
+
+        key, min_price, max_price = self.parse_query(query)
+        index = self.indexes.get(key, [])
+        position = 0 if min_price is None else bisect_left(index, (min_price, -1))
+        if position == len(index):
+            return None
+        price, product_id = index[position]
+        if max_price is not None and price > max_price:
+            return None
+        return self.products[product_id]
+
+    def matches(self, product, query):
+
+        #Verifica daca produsul ar raspunde interogarii, fie el disponibil sau nu
+        key, min_price, max_price = self.parse_query(query)
+        return key in self.index_keys(product) and \
+            (min_price is None or product.price >= min_price) and \
+            (max_price is None or product.price <= max_price)
+
+    def count(self, query):
+
+        #Numarul de unitati disponibile care raspund interogarii
+        key, min_price, max_price = self.parse_query(query)
+        index = self.indexes.get(key, [])
+        position = 0 if min_price is None else bisect_left(index, (min_price, -1))
+        units = 0
+        for price, product_id in index[position:]:
+            if max_price is not None and price > max_price:
+                break
+            units += self.available[self.products[product_id]]
+        return units
+
+
+#Tests for the catalog indexes
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.catalog = Catalog()
+        self.oolong = Tea('China Oolong', 7, 'Oolong')
+        self.cheap_oolong = Tea('Milky Oolong', 3, 'Oolong')
+        self.linden = Tea('Linden', 1, 'Herbal')
+        self.arabica = Coffee('Arabica', 5, 5.05, 'MEDIUM')
+        for product in [self.oolong, self.cheap_oolong, self.linden, self.arabica]:
+            self.catalog.add(product)
+
+    def test_cheapest(self):
+        self.assertEqual(self.catalog.cheapest({}), self.linden)
+        self.assertEqual(self.catalog.cheapest({"product_type": "Tea", "type": "Oolong"}),
+                         self.cheap_oolong)
+        self.assertEqual(self.catalog.cheapest({"product_type": "Coffee",
+                                                "roast_level": "MEDIUM"}), self.arabica)
+        self.assertEqual(self.catalog.cheapest({"product_type": "Tea", "type": "Oolong",
+                                                "min_price": 4}), self.oolong)
+        self.assertIsNone(self.catalog.cheapest({"product_type": "Coffee", "max_price": 4}))
+        with self.assertRaises(ValueError):
+            self.catalog.cheapest({"product_type": "Tea", "roast_level": "DARK"})
+        with self.assertRaises(ValueError):
+            self.catalog.cheapest({"product_type": "Juice"})
+
+    def test_availability(self):
+        self.catalog.add(self.cheap_oolong)
+        self.catalog.remove(self.cheap_oolong)
+        query = {"product_type": "Tea", "type": "Oolong"}
+        self.assertEqual(self.catalog.cheapest(query), self.cheap_oolong)
+        self.catalog.remove(self.cheap_oolong)
+        self.assertEqual(self.catalog.cheapest(query), self.oolong)
+        self.catalog.remove(self.oolong)
+        self.assertIsNone(self.catalog.cheapest(query))
+
+    def test_matches_and_count(self):
+        query = {"product_type": "Tea", "type": "Oolong", "max_price": 5}
+        self.assertTrue(self.catalog.matches(self.cheap_oolong, query))
+        self.assertFalse(self.catalog.matches(self.oolong, query))
+        self.assertFalse(self.catalog.matches(self.arabica, query))
+        self.catalog.add(self.cheap_oolong)
+        self.assertEqual(self.catalog.count(query), 2)
+        self.assertEqual(self.catalog.count({}), 5)
+        self.catalog.remove(self.cheap_oolong)
+        self.catalog.remove(self.cheap_oolong)
+        self.assertEqual(self.catalog.count(query), 0)
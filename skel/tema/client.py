@@ -0,0 +1,184 @@
+import socket
+import sys
+from concurrent.futures import Future
+from threading import Lock, local
+
+from tema.protocol import (OPCODES, STATUS_OK, MarketplaceError,
+                           parse_address, encode_frame, decode_frames)
+
+
+class MarketplaceConnection:
+
+    def __init__(self, address):
+
+        family, server_address = parse_address(address)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(server_address)
+        if family == socket.AF_INET:
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.buffer = bytearray()
+        self.next_request_id = 0
+
+    def execute(self, requests):
+
+        #Trimitem toate cererile intr-un singur sendall, apoi citim raspunsurile
+        #in ordine, pana cand fiecare cerere si-a primit rezultatul
+        out = bytearray()
+        first_request_id = self.next_request_id
+        for opcode, arguments in requests:
+            encode_frame(self.next_request_id, opcode, list(arguments), out)
+            self.next_request_id = (self.next_request_id + 1) & 0xFFFFFFFF
+        self.socket.sendall(out)
+
+        results = []
+        while len(results) < len(requests):
+            data = self.socket.recv(65536)
+            if not data:
+                raise MarketplaceError("Connection closed by marketplace server")
+            self.buffer += data
+            for request_id, status, value in decode_frames(self.buffer):
+                expected_id = (first_request_id + len(results)) & 0xFFFFFFFF
+                if request_id != expected_id:
+                    raise MarketplaceError(f"Unexpected response id {request_id}")
+                results.append((status, value))
+        return results
+
+    def close(self):
+        self.socket.close()
+
+
+class Pipeline:
+
+    def __init__(self, client):
+
+        #Cererile sunt doar retinute pana la execute(), cand pleaca toate
+        #odata catre server
+        self.client = client
+        self.requests = []
+        self.results = None
+
+    def __getattr__(self, name):
+
+        if name not in OPCODES:
+            raise AttributeError(name)
+
+        def enqueue(*arguments):
+            self.requests.append((OPCODES[name], arguments))
+            return len(self.requests) - 1
+
+        return enqueue
+
+    def execute(self):
+
+        requests, self.requests = self.requests, []
+        if not requests:
+            self.results = []
+            return self.results
+        self.results = []
+        for status, value in self.client.connection().execute(requests):
+            if status != STATUS_OK:
+                raise MarketplaceError(value)
+            self.results.append(value)
+        return self.results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+
+class MarketplaceClient:
+
+    def __init__(self, address):
+
+        #Fiecare thread care foloseste clientul primeste propria conexiune,
+        #astfel incat un obiect MarketplaceClient poate fi dat tuturor
+        #producatorilor si consumatorilor, exact ca un Marketplace local
+        self.address = address
+        self.lock_order = Lock()
+        self.lock_connections = Lock()
+        self.connections = []
+        self.local = local()
+
+    def connection(self):
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = MarketplaceConnection(self.address)
+            self.local.connection = connection
+            with self.lock_connections:
+                self.connections.append(connection)
+        return connection
+
+    def request(self, name, *arguments):
+
+        status, value = self.connection().execute([(OPCODES[name], arguments)])[0]
+        if status != STATUS_OK:
+            raise MarketplaceError(value)
+        return value
+
+    def pipeline(self):
+        return Pipeline(self)
+
+    def register_producer(self):
+        return self.request('register_producer')
+
+    def publish(self, identifier_producer, product):
+        return self.request('publish', identifier_producer, product)
+
+    def new_cart(self):
+        return self.request('new_cart')
+
+    def add_to_cart(self, identifier_cart, product):
+        return self.request('add_to_cart', identifier_cart, product)
+
+    def remove_from_cart(self, identifier_cart, product):
+        return self.request('remove_from_cart', identifier_cart, product)
+
+    def place_order(self, identifier_cart):
+        return self.request('place_order', identifier_cart)
+
+    def abandon_cart(self, identifier_cart):
+        return self.request('abandon_cart', identifier_cart)
+
+    def submit_order(self, identifier_cart, buyer=None):
+
+        #Pe server comanda trece prin committer-ul marketplace-ului; liniile
+        #de iesire pentru buyer sunt scrise aici, in procesul clientului
+        products = self.request('submit_order', identifier_cart)
+        if buyer is not None and products:
+            sys.stdout.write("".join(f"{buyer} bought {product}\n" for product in products))
+        future = Future()
+        future.set_result(products)
+        return future
+
+    def commit_orders(self, identifier_carts):
+        return self.request('commit_orders', identifier_carts)
+
+    def declare_demand(self, items):
+        return self.request('declare_demand', items)
+
+    def wait_for_demand(self, products):
+        return self.request('wait_for_demand', products)
+
+    def is_shut_down(self):
+        return self.request('is_shut_down')
+
+    def shutdown(self):
+        return self.request('shutdown')
+
+    def find_cheapest(self, query):
+        return self.request('find_cheapest', query)
+
+    def add_cheapest_to_cart(self, identifier_cart, query):
+        return self.request('add_cheapest_to_cart', identifier_cart, query)
+
+    def close(self):
+
+        with self.lock_connections:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = local()
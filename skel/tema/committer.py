@@ -0,0 +1,111 @@
+from concurrent.futures import Future
+from queue import Queue, Empty
+import sys
+from threading import Thread
+import unittest
+
+#Numarul maxim de comenzi finalizate intr-un singur lot
+MAX_BATCH_SIZE = 256
+
+
+class OrderCommitter(Thread):
+
+    def __init__(self, marketplace, max_batch_size=MAX_BATCH_SIZE, output=None):
+
+        #Consumatorii nu mai plaseaza comenzile sub lock_order, ci le pun in
+        #coada; acest thread le scoate pe loturi, le finalizeaza printr-un
+        #singur commit_orders si scrie iesirea lotului dintr-o data, apoi
+        #completeaza Future-ul fiecarei comenzi
+        Thread.__init__(self, name="OrderCommitter", daemon=True)
+        self.marketplace = marketplace
+        self.max_batch_size = max_batch_size
+        self.output = output
+        self.orders = Queue()
+
+    def submit(self, identifier_cart, buyer=None):
+
+        future = Future()
+        self.orders.put((identifier_cart, buyer, future))
+        return future
+
+    def stop(self):
+
+        #Comenzile deja trimise sunt finalizate inainte de oprire
+        self.orders.put(None)
+        self.join()
+
+    def next_batch(self):
+
+        #Asteptam prima comanda, apoi luam fara blocare tot ce s-a strans
+        #intre timp in coada
+        batch = [self.orders.get()]
+        while batch[-1] is not None and len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.orders.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def run(self):
+
+        running = True
+        while running:
+            batch = self.next_batch()
+            if batch[-1] is None:
+                running = False
+                batch.pop()
+            if not batch:
+                continue
+            try:
+                orders = self.marketplace.commit_orders([order[0] for order in batch])
+            except Exception as error: # pylint: disable=broad-except
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+
+            lines = [f"{buyer} bought {product}\n"
+                     for (_, buyer, _), products in zip(batch, orders) if buyer is not None
+                     for product in products]
+            if lines:
+                output = self.output or sys.stdout
+                output.write("".join(lines))
+                output.flush()
+            for (_, _, future), products in zip(batch, orders):
+                future.set_result(products)
+
+
+#Tests for the order committer
+
+class TestOrderCommitter(unittest.TestCase):
+    def test_batches(self):
+        class FakeMarketplace:
+            def __init__(self):
+                self.batches = []
+
+            def commit_orders(self, identifier_carts):
+                self.batches.append(list(identifier_carts))
+                return [[f"product{identifier_cart}"] if identifier_cart >= 0 else []
+                        for identifier_cart in identifier_carts]
+
+        class Output:
+            def __init__(self):
+                self.writes = []
+
+            def write(self, text):
+                self.writes.append(text)
+
+            def flush(self):
+                pass
+
+        marketplace = FakeMarketplace()
+        output = Output()
+        committer = OrderCommitter(marketplace, max_batch_size=2, output=output)
+        #Comenzile sunt puse in coada inainte de pornire, deci se strang in loturi
+        futures = [committer.submit(0, "cons1"), committer.submit(-1, "cons1"),
+                   committer.submit(2, None)]
+        committer.start()
+        committer.stop()
+
+        self.assertEqual([future.result() for future in futures], [["product0"], [], ["product2"]])
+        self.assertEqual(marketplace.batches, [[0, -1], [2]])
+        self.assertEqual(output.writes, ["cons1 bought product0\n"])
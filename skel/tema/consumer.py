@@ -1,15 +1,29 @@
-from threading import Thread
-from time import sleep
+from threading import Thread, Timer
+from time import perf_counter, sleep
+import unittest
+
+from tema.planner import (ADD_CHEAPEST_OP, plan_cart, plan_queries, execute_plan,
+                          forecast_demand)
 
 class Consumer(Thread):
 
-    def __init__(self, carts, marketplace, retry_wait_time, **kwargs):
+    def __init__(self, carts, marketplace, retry_wait_time, plan_carts=True,
+                 group_commit=True, **kwargs):
 
         Thread.__init__(self, **kwargs)
         self.kwargs = kwargs
         self.carts = carts
         self.marketplace = marketplace
         self.retry_wait_time = retry_wait_time
+        #Cu plan_carts, operatiile unui cos sunt reduse la cantitatile nete si
+        #executate de planner (tema/planner.py); altfel se executa strict in ordine
+        self.plan_carts = plan_carts
+        #Cu group_commit, comenzile sunt trimise committer-ului marketplace-ului
+        #(tema/committer.py), care le finalizeaza pe loturi si scrie iesirea
+        self.group_commit = group_commit
+        #Pentru fiecare cos, timpul (in secunde) de la crearea lui pana cand
+        #toate produsele sunt rezervate, adica cat a stat blocat consumatorul
+        self.blocked_times = []
 
     def run(self):
         def add_to_cart(product, quantity, identifier_cart):
@@ -28,6 +42,16 @@ class Consumer(Thread):
                 if added_products == quantity:
                     break
 
+        # Pentru o operatie add_cheapest, cerem la fiecare pas cel mai ieftin
+        # produs disponibil care respecta interogarea, pana la cantitatea dorita
+        def add_cheapest_to_cart(query, quantity, identifier_cart):
+            added_products = 0
+            while added_products < quantity:
+                if self.marketplace.add_cheapest_to_cart(identifier_cart, query) is None:
+                    sleep(self.retry_wait_time)
+                else:
+                    added_products += 1
+
         # Cat timp inca avem produse ce trebuie scoase din cos, se va apela
         # functia de remove_from_cart din clasa Marketplace
         def remove_from_cart(product, quantity, identifier_cart):
@@ -39,26 +63,76 @@ class Consumer(Thread):
                 self.marketplace.remove_from_cart(identifier_cart, product)
 
         result = []
+        orders = []
+
+        # Anuntam de la inceput cererea tuturor cosurilor, pentru ca
+        # producatorii sa stie ce si cat sa produca
+        self.marketplace.declare_demand(forecast_demand(self.carts, self.plan_carts))
 
         # Parcurgem fiecare cart din input
         for current_cart in self.carts:
             # Creem acest nou cart, fiind valabil pentru adaugare si scoatere de produse
             identifier_cart = self.marketplace.new_cart()
-            # Realizam actiunile de add sau remove pentru produsele dorite
-            for action in current_cart:
-                apply_function = action["type"]
-                product = action["product"]
-                quantity = action["quantity"]
-                if apply_function == "remove":
-                    remove_from_cart(product, quantity, identifier_cart)
-                else:
-                    add_to_cart(product, quantity, identifier_cart)
+            cart_start = perf_counter()
+            if self.plan_carts:
+                # Planner-ul rezerva direct cantitatile nete ale cosului
+                execute_plan(self.marketplace, identifier_cart, plan_cart(current_cart),
+                             self.retry_wait_time, plan_queries(current_cart))
+            else:
+                # Realizam actiunile de add sau remove pentru produsele dorite
+                for action in current_cart:
+                    apply_function = action["type"]
+                    quantity = action["quantity"]
+                    if apply_function == ADD_CHEAPEST_OP:
+                        add_cheapest_to_cart(action["query"], quantity, identifier_cart)
+                        continue
+                    product = action["product"]
+                    if apply_function == "remove":
+                        remove_from_cart(product, quantity, identifier_cart)
+                    else:
+                        add_to_cart(product, quantity, identifier_cart)
+            self.blocked_times.append(perf_counter() - cart_start)
             # Odata finalizat state-ul final al cart-ului, plasam comanda
             # si afisam produsele finale ce au fost cumparate
+            if self.group_commit:
+                orders.append(self.marketplace.submit_order(identifier_cart, self.name))
+                continue
             products_bought = self.marketplace.place_order(identifier_cart)
             result.extend(list(map(lambda product: f"{self.name} bought {product}", products_bought)))
 
+        # Committer-ul a afisat deja produsele; asteptam doar comenzile
+        if self.group_commit:
+            for order in orders:
+                order.result()
+            return
+
         final_result = "\n".join(result)
 
         with self.marketplace.lock_order:
             print(final_result)
+
+
+#Tests for the per-cart blocked time
+
+class TestConsumer(unittest.TestCase):
+    def test_blocked_times(self):
+        from tema.marketplace import Marketplace
+        from tema.product import Tea
+
+        product = Tea('Linden', 9, 'Herbal')
+        carts = [[{"type": "add", "product": product, "quantity": 1}],
+                 [{"type": "add", "product": product, "quantity": 1},
+                  {"type": "remove", "product": product, "quantity": 1}]]
+        for plan_carts in (True, False):
+            marketplace = Marketplace(5)
+            producer_id = marketplace.register_producer()
+            #Produsul apare in stoc abia dupa 0.2s, deci primul cos sta blocat
+            publisher = Timer(0.2, marketplace.publish, (producer_id, product))
+            consumer = Consumer(carts, marketplace, 0.01, plan_carts=plan_carts,
+                                group_commit=False, name="cons1")
+            publisher.start()
+            consumer.start()
+            consumer.join(5)
+            marketplace.shutdown()
+            self.assertEqual(len(consumer.blocked_times), 2)
+            self.assertGreaterEqual(consumer.blocked_times[0], 0.15)
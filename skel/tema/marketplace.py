@@ -1,20 +1,45 @@
-from threading import Lock
+from concurrent.futures import Future
+from threading import Condition, Lock, RLock, Thread
 import logging
+import sys
 import unittest
 
+from tema.catalog import Catalog
+from tema.committer import OrderCommitter
+from tema.product import Product
+from tema.recorder import recorded
+from tema.protocol import (REGISTER_PRODUCER, PUBLISH, NEW_CART, ADD_TO_CART,
+                           REMOVE_FROM_CART, PLACE_ORDER, ABANDON_CART,
+                           ADD_CHEAPEST_TO_CART, COMMIT_ORDERS)
+
+#Id-ul unui cos contine indexul slotului in bitii de jos si generatia
+#slotului in bitii de sus
+CART_SLOT_BITS = 32
+CART_SLOT_MASK = (1 << CART_SLOT_BITS) - 1
+
+def query_key(query):
+
+    #Cheia sub care este tinuta cererea pentru o interogare add_cheapest
+    return tuple(sorted(query.items()))
+
+
 class Marketplace:
 
-    def __init__(self, queue_size_per_producer):
+    def __init__(self, queue_size_per_producer, recorder=None):
 
         self.queue_size_per_producer = queue_size_per_producer
+        #Daca este dat, recorder-ul primeste fiecare operatie executata
+        #(vezi tema/recorder.py), pentru a putea fi reluata ulterior
+        self.recorder = recorder
 
         #Creem lock-urile pentru a putea lucra thread safe cu comenzile,
         #producatorii si operatiile de aprovizionare de stock sau cumparare
         self.lock_order = Lock()
         self.lock_cart = Lock()
         self.lock_producer = Lock()
+        #Protejeaza stocul disponibil impreuna cu indexurile catalogului
+        self.lock_catalog = RLock()
 
-        self.identifier_cart = 0
         self.identifier_producer = 0
 
         #Creem configurarile pentru afisarea logg-urilor in fisierul maketplace.log
@@ -34,93 +59,407 @@ class Marketplace:
         for key in ['reserved_products', 'marketplace_products', 'available_products']:
             self.database[key] = {}
 
+        #Cosurile sunt tinute intr-o tabela compacta de sloturi: un slot eliberat
+        #la plasarea comenzii sau la abandonarea cosului este refolosit de
+        #urmatorul new_cart. Fiecare slot are un contor de generatie, inclus in
+        #id-ul cosului, astfel incat un id vechi nu mai poate atinge noul cos
+        self.database['reserved_products'] = []
+        self.cart_generations = []
+        self.free_carts = []
+
+        #Catalogul tine indexuri sortate dupa pret ale produselor disponibile,
+        #actualizate la fiecare publicare, rezervare sau scoatere din cos
+        self.catalog = Catalog()
+
+        #Committer-ul comenzilor trimise prin submit_order, pornit la prima
+        #comanda (vezi tema/committer.py) si oprit la shutdown, ambele sub
+        #lock_committer
+        self.committer = None
+        self.lock_committer = Lock()
+
+        #Cererea declarata de consumatori: unitati dorite pentru fiecare produs
+        #si pentru fiecare interogare add_cheapest. Producatorii in modul
+        #demand_driven asteapta pe condition_demand (legata de lock_catalog,
+        #care protejeaza si stocul) pana cand cererea depaseste stocul sau
+        #pana la shutdown
+        self.demand = {}
+        self.query_demand = {}
+        self.condition_demand = Condition(self.lock_catalog)
+        self.stopped = False
+
+    @recorded(REGISTER_PRODUCER)
     def register_producer(self):
 
         #Deschidem lock-ul pentru a proteja urmatoarera zona de cod
         self.lock_producer.acquire()
         #Obtinem urmatorul id pentru producator, apoi il asignam in dictionar cu
-        #o lista goala
-        self.identifier_producer = self.identifier_producer + 1
-        identifier_producer = self.identifier_producer - 1
-        self.logger.info("Operation Accepted: Succesfully registered producer with id: %s", identifier_producer)
+        #o lista goala. Lista este creata inainte ca id-ul sa devina vizibil
+        #pentru cautarea din add_to_cart, altfel aceasta ar da peste o cheie lipsa
+        identifier_producer = self.identifier_producer
         self.database['available_products'][identifier_producer] = []
+        self.identifier_producer = identifier_producer + 1
+        self.logger.info("Operation Accepted: Succesfully registered producer with id: %s", identifier_producer)
+        self.note_effect()
         self.lock_producer.release()
         return identifier_producer
 
+    @recorded(PUBLISH)
     def publish(self, identifier_producer, product):
 
+        #Dupa shutdown nu se mai accepta produse noi
+        if self.stopped:
+            self.logger.error("Operation Rejected: Marketplace is shut down, product %s was not published", product.__str__())
+            return False
         #Cand un produs este publicat, acesta ajunge atat ca fiind valabil pentru cumparare
         #dar este si contorizat in marketplace. Astfel, produsul este pus in dictionar corespunzator
         self.logger.info("Operation Accepted: Product %s was succesfully published by producer with id %d", product.__str__(), identifier_producer)
-        self.database['available_products'][identifier_producer].append(product)
-        self.database['marketplace_products'][product] = identifier_producer
+        with self.lock_catalog:
+            self.database['available_products'][identifier_producer].append(product)
+            self.database['marketplace_products'][product] = identifier_producer
+            self.catalog.add(product)
+            self.note_effect(identifier_producer)
         return True
 
+    @recorded(NEW_CART)
     def new_cart(self):
 
         #Deschidem lock-ul pentru a proteja urmatoarera zona de cod
         self.lock_cart.acquire()
         #Odata ce un nou cart se creaza, instantiem o noua lista goala
-        #in dictionar pentru a putea in viitor sa adaugam noi produse
-        self.logger.info("Operation Accepted: Sucessfully created cart with id: %d", self.identifier_cart)
-        self.database['reserved_products'][self.identifier_cart] = []
-        self.identifier_cart = self.identifier_cart + 1
+        #intr-un slot liber (sau intr-unul nou) pentru a putea in viitor sa
+        #adaugam noi produse
+        reserved_products = self.database['reserved_products']
+        if self.free_carts:
+            slot = self.free_carts.pop()
+            reserved_products[slot] = []
+        else:
+            slot = len(reserved_products)
+            reserved_products.append([])
+            self.cart_generations.append(0)
+        identifier_cart = (self.cart_generations[slot] << CART_SLOT_BITS) | slot
+        self.note_effect()
+        self.logger.info("Operation Accepted: Sucessfully created cart with id: %d", identifier_cart)
         self.lock_cart.release()
-        return self.identifier_cart - 1
+        return identifier_cart
+
+    def cart_products(self, identifier_cart):
+
+        #Intoarce lista de produse rezervate in cos, sau None daca id-ul nu
+        #corespunde unui cos activ (slot liber sau generatie expirata)
+        slot = identifier_cart & CART_SLOT_MASK
+        if slot >= len(self.cart_generations) or \
+                self.cart_generations[slot] != identifier_cart >> CART_SLOT_BITS:
+            return None
+        return self.database['reserved_products'][slot]
+
+    def free_cart(self, identifier_cart):
+
+        #Eliberam slotul cosului si ii crestem generatia, astfel incat
+        #id-ul curent devine invalid chiar daca slotul va fi refolosit.
+        #Generatia este verificata din nou sub lock_cart, pentru ca un cos
+        #sa nu poata fi eliberat de doua ori; intoarce daca slotul a fost eliberat
+        slot = identifier_cart & CART_SLOT_MASK
+        with self.lock_cart:
+            if self.cart_products(identifier_cart) is None:
+                return False
+            self.database['reserved_products'][slot] = None
+            self.cart_generations[slot] += 1
+            self.free_carts.append(slot)
+            self.note_effect()
+            return True
+
+    @recorded(ABANDON_CART)
+    def abandon_cart(self, identifier_cart):
+
+        #Un cos abandonat isi intoarce produsele rezervate in marketplace,
+        #apoi slotul lui este eliberat pentru a fi refolosit. Verificarea si
+        #eliberarea se fac sub lock_order, ca si in place_order, pentru ca un
+        #cos sa nu poata fi abandonat si comandat (sau abandonat) de doua ori,
+        #si sub lock_catalog, ca niciun add_to_cart sa nu ajunga in cos dupa
+        #ce produsele lui au fost intoarse
+        with self.lock_order, self.lock_catalog:
+            cart_products = self.cart_products(identifier_cart)
+            if cart_products is not None:
+                for product in list(cart_products):
+                    self.remove_from_cart(identifier_cart, product)
+            freed = cart_products is not None and self.free_cart(identifier_cart)
+        if not freed:
+            self.logger.error("Operation Rejected: Cart with id %d does not exist", identifier_cart)
+            return False
+        self.logger.info("Operation Accepted: Succesfully abandoned cart with id %d", identifier_cart)
+        return True
 
+    @recorded(ADD_TO_CART)
     def add_to_cart(self, identifier_cart, product):
 
         try:
-            #Pentru a putea adauga un produs in cos, acesta trebuie sa se afle
-            #in lista de produse valabile.
-            identifier_producer = -1
-            for i in range(self.identifier_producer):
-                if product in self.database['available_products'][i]:
-                    identifier_producer = i
-                    break
-            #Daca produsul este valabil, il adaugam in lista de produse
-            #rezervate si il scoatem din cea de produse valabile
-            if identifier_producer >= 0:
+            #Cautarea si mutarea produsului se fac sub lock_catalog, pentru ca
+            #stocul si indexurile catalogului sa ramana consistente
+            with self.lock_catalog:
+                #Pentru a putea adauga un produs in cos, acesta trebuie sa se afle
+                #in lista de produse valabile.
+                identifier_producer = -1
+                for i in range(self.identifier_producer):
+                    if product in self.database['available_products'][i]:
+                        identifier_producer = i
+                        break
+                if identifier_producer < 0:
+                    self.note_effect()
+                    return False
+                #Daca produsul este valabil, il adaugam in lista de produse
+                #rezervate si il scoatem din cea de produse valabile
+                reserved_products = self.cart_products(identifier_cart)
+                if reserved_products is None:
+                    self.note_effect()
+                    self.logger.error("Operation Rejected: Cart with id %d does not exist", identifier_cart)
+                    return False
                 available_products = self.database['available_products'][identifier_producer]
-                reserved_products = self.database['reserved_products'][identifier_cart]
                 available_products.remove(product)
                 reserved_products.append(product)
-                self.logger.info("Operation Accepted: Succesfully removed product %s from producer with id %d", product.__str__(), identifier_producer)
-                self.logger.info("Operation Accepted: Succesfully added product %s in cart with id %d", product.__str__(), identifier_cart)
-                return True
-            return False
+                self.catalog.remove(product)
+                #Rezervarea acopera o unitate din cererea declarata; fara
+                #cerere declarata, stocul scade si producatorii sunt treziti
+                if not self.take_demand(self.demand, product):
+                    self.condition_demand.notify_all()
+                self.note_effect(identifier_producer)
+            self.logger.info("Operation Accepted: Succesfully removed product %s from producer with id %d", product.__str__(), identifier_producer)
+            self.logger.info("Operation Accepted: Succesfully added product %s in cart with id %d", product.__str__(), identifier_cart)
+            return True
         except Exception as thrown_exception:
             self.logger.error("Operation Rejected: Error adding product to cart: %s", thrown_exception.__str__())
             return False
 
+    @recorded(REMOVE_FROM_CART)
     def remove_from_cart(self, identifier_cart, product):
 
         #Daca produsul se afla in lista de produse a cosului dat ca
-        #parametru, este scos si adaugat in lista de produse valabile din marketplace
-        cart_products = self.database['reserved_products'].get(identifier_cart, [])
-        if product in cart_products:
+        #parametru, este scos si adaugat in lista de produse valabile din marketplace.
+        #Cautarea cosului si mutarea se fac sub lock_catalog, acelasi lock sub
+        #care checkout finalizeaza cosul
+        with self.lock_catalog:
+            cart_products = self.cart_products(identifier_cart) or []
+            if product not in cart_products:
+                return
             producer = self.database['marketplace_products'].get(product)
-            if producer is not None:
-                available_products = self.database['available_products'].get(producer, [])
-                available_products.append(product)
-                self.database['available_products'][producer] = available_products
-                reserved_products = self.database['reserved_products'].get(identifier_cart, [])
-                reserved_products.remove(product)
-                self.database['reserved_products'][identifier_cart] = reserved_products
-
+            if producer is None:
+                return
+            available_products = self.database['available_products'].get(producer, [])
+            available_products.append(product)
+            self.database['available_products'][producer] = available_products
+            cart_products.remove(product)
+            self.catalog.add(product)
+            self.note_effect(producer)
+
+    def find_cheapest(self, query):
+
+        #Intoarce cel mai ieftin produs disponibil care respecta interogarea
+        #(ex: {"product_type": "Tea", "type": "Oolong", "max_price": 5}),
+        #sau None daca nu exista niciunul in stoc. O interogare invalida
+        #arunca ValueError: None ar face consumatorul sa reincerce la nesfarsit
+        with self.lock_catalog:
+            try:
+                return self.catalog.cheapest(query)
+            except ValueError as thrown_exception:
+                self.logger.error("Operation Rejected: Invalid query %s: %s", query.__str__(), thrown_exception.__str__())
+                raise
+
+    @recorded(ADD_CHEAPEST_TO_CART)
+    def add_cheapest_to_cart(self, identifier_cart, query):
+
+        #Cautarea si rezervarea se fac sub acelasi lock, astfel incat produsul
+        #gasit nu poate fi luat de alt consumator intre cele doua operatii.
+        #Intoarce produsul adaugat in cos, None daca nu exista stoc, sau
+        #arunca ValueError pentru o interogare invalida
+        with self.lock_catalog:
+            product = self.find_cheapest(query)
+            if product is None:
+                self.note_effect()
+                return None
+            #Unitatea acopera cererea interogarii, nu pe cea a produsului gasit
+            product_demand = self.demand.get(product)
+            if not self.add_to_cart(identifier_cart, product):
+                self.note_effect()
+                return None
+            if product_demand is not None:
+                self.demand[product] = product_demand
+            self.take_demand(self.query_demand, query_key(query))
+            self.condition_demand.notify_all()
+            self.note_effect()
+            return product
+
+    def checkout(self, identifier_cart):
+
+        #Finalizeaza cosul: produsele lui devin comanda, iar slotul este
+        #eliberat pentru a nu pastra cate o intrare pentru fiecare cos creat
+        #vreodata. Intoarce None pentru un cos inexistent. Totul se face sub
+        #lock_catalog, sub care add_to_cart si remove_from_cart modifica
+        #cosul, pentru ca nicio unitate sa nu fie adaugata intr-un cos deja
+        #comandat sau scoasa dintr-o comanda deja copiata
+        with self.lock_catalog:
+            cart_products = self.cart_products(identifier_cart)
+            if cart_products is None:
+                self.note_effect()
+                return None
+            order_to_place = list(cart_products)
+            if not self.free_cart(identifier_cart):
+                self.note_effect()
+                return None
+            return order_to_place
+
+    @recorded(PLACE_ORDER)
     def place_order(self, identifier_cart):
 
-        #Deschidem lock-ul pentru a proteja urmatoarera zona de cod
-        self.lock_order.acquire()
-        reserved_products = self.database.get('reserved_products', {})
-        cart_products = reserved_products.get(identifier_cart, [])
-        order_to_place = list(cart_products)
-        reserved_products[identifier_cart] = []
-        self.database['reserved_products'] = reserved_products
+        #Sub lock doar finalizam cosul; mesajul de log este formatat dupa
+        #eliberarea lock-ului
+        with self.lock_order:
+            order_to_place = self.checkout(identifier_cart)
+        if order_to_place is None:
+            self.logger.error("Operation Rejected: Cart with id %d does not exist", identifier_cart)
+            return []
         self.logger.info("Operation Accepted: Succesfully placed order %s from cart with id %d", order_to_place.__str__(), identifier_cart)
-        self.lock_order.release()
         return order_to_place
 
+    @recorded(COMMIT_ORDERS)
+    def commit_orders(self, identifier_carts):
+
+        #Varianta pe loturi a place_order, folosita de OrderCommitter: toate
+        #cosurile sunt finalizate intr-o singura trecere, iar logul lotului
+        #este scris o singura data
+        with self.lock_order:
+            orders = [self.checkout(identifier_cart) for identifier_cart in identifier_carts]
+        rejected = [identifier_cart for identifier_cart, order in zip(identifier_carts, orders)
+                    if order is None]
+        if rejected:
+            self.logger.error("Operation Rejected: Carts with ids %s do not exist", rejected.__str__())
+        orders = [order or [] for order in orders]
+        self.logger.info("Operation Accepted: Succesfully placed orders %s from carts with ids %s", orders.__str__(), identifier_carts.__str__())
+        return orders
+
+    def submit_order(self, identifier_cart, buyer=None):
+
+        #Trimite cosul catre OrderCommitter si intoarce un Future cu produsele
+        #comandate. Daca buyer este dat, liniile "buyer bought produs" sunt
+        #scrise la iesire de committer, impreuna cu restul lotului. Dupa
+        #shutdown committer-ul este oprit, asa ca, la fel ca publish, comanda
+        #este refuzata cu un Future deja completat cu o lista goala
+        with self.lock_committer:
+            if not self.stopped:
+                if self.committer is None:
+                    self.committer = OrderCommitter(self)
+                    self.committer.start()
+                return self.committer.submit(identifier_cart, buyer)
+        self.logger.error("Operation Rejected: Marketplace is shut down, order from cart with id %d was not placed", identifier_cart)
+        rejected = Future()
+        rejected.set_result([])
+        return rejected
+
+    def note_effect(self, identifier_producer=None):
+
+        #Cand se inregistreaza, operatia curenta isi ia numarul de ordine sub
+        #lock-ul care ii ordoneaza efectul (vezi Recorder.note_effect)
+        if self.recorder is not None:
+            self.recorder.note_effect(identifier_producer)
+
+    def take_demand(self, demand, key):
+
+        #Scade o unitate din cererea pentru key; intrarile epuizate sunt sterse
+        #pentru ca memoria sa nu creasca cu fiecare produs cerut vreodata
+        entry = demand.get(key)
+        if entry is None:
+            return False
+        if isinstance(entry, list):
+            entry[1] -= 1
+            if entry[1] == 0:
+                del demand[key]
+        elif entry == 1:
+            del demand[key]
+        else:
+            demand[key] = entry - 1
+        return True
+
+    def declare_demand(self, items):
+
+        #Consumatorii anunta ce vor cumpara, ca perechi [produs sau
+        #interogare, cantitate]; rezervarile ulterioare consuma aceasta cerere.
+        #Interogarile sunt validate inainte de a inregistra ceva, astfel incat
+        #producatorii nu dau niciodata peste o interogare invalida
+        with self.condition_demand:
+            for item, _ in items:
+                if isinstance(item, dict):
+                    self.catalog.parse_query(item)
+            for item, quantity in items:
+                if isinstance(item, dict):
+                    entry = self.query_demand.setdefault(query_key(item), [item, 0])
+                    entry[1] += quantity
+                else:
+                    self.demand[item] = self.demand.get(item, 0) + quantity
+            self.condition_demand.notify_all()
+
+    def unmet_demand(self, product):
+
+        #Apelata sub lock_catalog: produsul este cerut daca cererea pentru el
+        #sau pentru o interogare pe care o satisface depaseste stocul disponibil
+        if self.demand.get(product, 0) > self.catalog.available.get(product, 0):
+            return True
+        return any(quantity > self.catalog.count(query)
+                   for query, quantity in self.query_demand.values()
+                   if self.catalog.matches(product, query))
+
+    def wait_for_demand(self, products):
+
+        #Blocheaza producatorul pana cand cel putin unul dintre produsele lui
+        #este cerut si intoarce indexurile produselor cerute, sau None dupa
+        #shutdown
+        with self.condition_demand:
+            while not self.stopped:
+                wanted = [index for index, product in enumerate(products)
+                          if self.unmet_demand(product)]
+                if wanted:
+                    return wanted
+                self.condition_demand.wait()
+            return None
+
+    def is_shut_down(self):
+        return self.stopped
+
+    def shutdown(self):
+
+        #Oprire coordonata, apelata dupa terminarea consumatorilor: publish nu
+        #mai accepta produse, producatorii care asteapta cerere sunt treziti si
+        #se opresc, iar comenzile ramase in committer sunt finalizate
+        with self.condition_demand:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.demand.clear()
+            self.query_demand.clear()
+            self.condition_demand.notify_all()
+        #Orice submit_order care a trecut de verificarea lui stopped si-a pus
+        #deja comanda in coada, inaintea semnalului de oprire
+        with self.lock_committer:
+            committer = self.committer
+            self.committer = None
+        if committer is not None:
+            committer.stop()
+        self.logger.info("Operation Accepted: Marketplace was shut down")
+
+    def checkpoint(self):
+
+        #Trimite recorder-ului stocul disponibil si rezervat al fiecarui
+        #produs, pentru verificarea conservarii stocului (check_conservation.py).
+        #Valorile sunt exacte doar cand nicio alta operatie nu este in curs
+        if self.recorder is None:
+            return
+        available = {}
+        for available_products in list(self.database['available_products'].values()):
+            for product in list(available_products):
+                available[product] = available.get(product, 0) + 1
+        reserved = {}
+        for cart_products in list(self.database['reserved_products']):
+            for product in list(cart_products or []):
+                reserved[product] = reserved.get(product, 0) + 1
+        self.recorder.snapshot(available, reserved)
+
 
 #Tests for Marketplace flow
 
@@ -184,11 +523,262 @@ class TestMarketplace(unittest.TestCase):
     def test_place_order(self):
         producer_id = self.marketplace.register_producer()
         product = Product('product', 10)
+        self.marketplace.publish(producer_id, product)
 
         cart_id = self.marketplace.new_cart()
         self.marketplace.add_to_cart(cart_id, product)
         order = self.marketplace.place_order(cart_id)
         self.assertEqual(order, [product])
-        self.assertEqual(len(self.marketplace.database['reserved_products'][cart_id]), 0)
+        self.assertIsNone(self.marketplace.database['reserved_products'][cart_id])
+
+        cart_id_2 = self.marketplace.new_cart()
+        self.assertNotEqual(cart_id_2, cart_id)
+        self.assertEqual(cart_id_2 & CART_SLOT_MASK, cart_id & CART_SLOT_MASK)
+        self.assertIsNone(self.marketplace.cart_products(cart_id))
+        self.assertEqual(self.marketplace.place_order(cart_id), [])
+
+
+#Tests for cart slot recycling
+
+class TestCartSlots(unittest.TestCase):
+    def setUp(self):
+        self.marketplace = Marketplace(5)
+        self.producer_id = self.marketplace.register_producer()
+        self.product = Product('product', 10)
+        self.marketplace.publish(self.producer_id, self.product)
+
+    def test_reuse_after_order(self):
+        cart_id = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.add_to_cart(cart_id, self.product))
+        self.assertEqual(self.marketplace.place_order(cart_id), [self.product])
+
+        cart_id_2 = self.marketplace.new_cart()
+        self.assertEqual(cart_id_2 & CART_SLOT_MASK, cart_id & CART_SLOT_MASK)
+        self.assertNotEqual(cart_id_2, cart_id)
+        self.assertEqual(self.marketplace.cart_products(cart_id_2), [])
 
+    def test_reuse_after_abandon(self):
+        cart_id = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.add_to_cart(cart_id, self.product))
+        self.assertTrue(self.marketplace.abandon_cart(cart_id))
+        self.assertEqual(self.marketplace.database['available_products'][self.producer_id],
+                         [self.product])
+
+        cart_id_2 = self.marketplace.new_cart()
+        self.assertEqual(cart_id_2 & CART_SLOT_MASK, cart_id & CART_SLOT_MASK)
+        self.assertNotEqual(cart_id_2, cart_id)
+
+    def test_stale_ids(self):
+        cart_id = self.marketplace.new_cart()
+        self.marketplace.place_order(cart_id)
         cart_id_2 = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.add_to_cart(cart_id_2, self.product))
+
+        #Id-ul vechi nu mai atinge cosul nou din acelasi slot
+        self.assertFalse(self.marketplace.add_to_cart(cart_id, self.product))
+        self.marketplace.remove_from_cart(cart_id, self.product)
+        self.assertEqual(self.marketplace.cart_products(cart_id_2), [self.product])
+        self.assertEqual(self.marketplace.place_order(cart_id), [])
+        self.assertFalse(self.marketplace.abandon_cart(cart_id))
+        self.assertEqual(self.marketplace.place_order(cart_id_2), [self.product])
+
+    def test_double_abandon(self):
+        cart_id = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.abandon_cart(cart_id))
+        self.assertFalse(self.marketplace.abandon_cart(cart_id))
+        self.assertEqual(self.marketplace.place_order(cart_id), [])
+        self.assertEqual(self.marketplace.free_carts, [cart_id & CART_SLOT_MASK])
+
+        #Slotul eliberat o singura data este refolosit de un singur cos
+        self.assertNotEqual(self.marketplace.new_cart(), self.marketplace.new_cart())
+
+    def test_double_free(self):
+        cart_id = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.free_cart(cart_id))
+        self.assertFalse(self.marketplace.free_cart(cart_id))
+        self.assertEqual(self.marketplace.free_carts, [cart_id & CART_SLOT_MASK])
+
+    def test_concurrent_abandon_and_order(self):
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for _ in range(100):
+                #Cu produse in cos, abandon_cart are de scos produsele intre
+                #verificarea cosului si eliberarea slotului
+                cart_id = self.marketplace.new_cart()
+                for _ in range(10):
+                    self.marketplace.publish(self.producer_id, self.product)
+                    self.marketplace.add_to_cart(cart_id, self.product)
+                threads = [Thread(target=self.marketplace.abandon_cart, args=(cart_id,)),
+                           Thread(target=self.marketplace.place_order, args=(cart_id,))]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(len(self.marketplace.free_carts),
+                                 len(set(self.marketplace.free_carts)))
+                self.assertNotEqual(self.marketplace.new_cart(), self.marketplace.new_cart())
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+
+#Tests for demand-driven production
+
+class TestDemand(unittest.TestCase):
+    def setUp(self):
+        self.marketplace = Marketplace(5)
+        self.producer_id = self.marketplace.register_producer()
+        self.product = Product('product', 10)
+        self.other_product = Product('other', 20)
+
+    def wait_in_thread(self, products):
+        #Porneste un producator care asteapta cerere si intoarce thread-ul
+        #impreuna cu lista in care va aparea rezultatul
+        results = []
+        thread = Thread(target=lambda: results.append(self.marketplace.wait_for_demand(products)))
+        thread.start()
+        return thread, results
+
+    def test_wait_until_demand_is_declared(self):
+        thread, results = self.wait_in_thread([self.other_product, self.product])
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        self.marketplace.declare_demand([[self.product, 1]])
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [[1]])
+
+        #Cererea acoperita de stoc nu mai este nesatisfacuta
+        self.marketplace.publish(self.producer_id, self.product)
+        self.assertFalse(self.marketplace.unmet_demand(self.product))
+
+    def test_reservation_consumes_demand(self):
+        self.marketplace.declare_demand([[self.product, 2]])
+        self.marketplace.publish(self.producer_id, self.product)
+        cart_id = self.marketplace.new_cart()
+        self.assertTrue(self.marketplace.add_to_cart(cart_id, self.product))
+        self.assertEqual(self.marketplace.demand, {self.product: 1})
+        self.assertEqual(self.marketplace.wait_for_demand([self.product]), [0])
+
+        self.marketplace.publish(self.producer_id, self.product)
+        self.assertTrue(self.marketplace.add_to_cart(cart_id, self.product))
+        self.assertEqual(self.marketplace.demand, {})
+
+    def test_add_cheapest_consumes_query_demand(self):
+        query = {"product_type": "Product", "max_price": 15}
+        self.marketplace.declare_demand([[self.product, 1], [query, 1]])
+        self.marketplace.publish(self.producer_id, self.product)
+        self.marketplace.publish(self.producer_id, self.product)
+        cart_id = self.marketplace.new_cart()
+
+        self.assertEqual(self.marketplace.add_cheapest_to_cart(cart_id, query), self.product)
+        self.assertEqual(self.marketplace.query_demand, {})
+        self.assertEqual(self.marketplace.demand, {self.product: 1})
+
+        #Unitatea ramasa acopera o singura cerere a interogarii; produsul mai
+        #scump nu raspunde interogarii, deci nu este cerut
+        self.marketplace.declare_demand([[query, 1]])
+        self.assertFalse(self.marketplace.unmet_demand(self.product))
+        self.marketplace.declare_demand([[query, 1]])
+        self.assertTrue(self.marketplace.unmet_demand(self.product))
+        self.assertFalse(self.marketplace.unmet_demand(self.other_product))
+
+    def test_invalid_query_is_rejected(self):
+        #O interogare invalida arunca eroare in loc sa intoarca None, care
+        #inseamna doar lipsa stocului
+        self.marketplace.publish(self.producer_id, self.product)
+        cart_id = self.marketplace.new_cart()
+        for query in [{"product_type": "Juice"}, {"product_type": "Tea", "roast_level": "DARK"}]:
+            with self.assertRaises(ValueError):
+                self.marketplace.add_cheapest_to_cart(cart_id, query)
+            with self.assertRaises(ValueError):
+                self.marketplace.declare_demand([[self.product, 1], [query, 1]])
+        self.assertEqual(self.marketplace.demand, {})
+        self.assertEqual(self.marketplace.query_demand, {})
+        self.assertIsNone(self.marketplace.add_cheapest_to_cart(cart_id, {"max_price": 5}))
+        self.assertEqual(self.marketplace.place_order(cart_id), [])
+
+
+#Tests for the coordinated shutdown
+
+class TestShutdown(unittest.TestCase):
+    def setUp(self):
+        self.marketplace = Marketplace(5)
+        self.producer_id = self.marketplace.register_producer()
+        self.product = Product('product', 10)
+
+    def test_submit_order_after_shutdown(self):
+        self.marketplace.publish(self.producer_id, self.product)
+        cart_id = self.marketplace.new_cart()
+        self.marketplace.add_to_cart(cart_id, self.product)
+        placed = self.marketplace.submit_order(cart_id)
+        cart_id_2 = self.marketplace.new_cart()
+        self.marketplace.shutdown()
+
+        #Comanda trimisa inainte de shutdown este finalizata, cea de dupa refuzata
+        self.assertEqual(placed.result(timeout=2), [self.product])
+        self.assertEqual(self.marketplace.submit_order(cart_id_2).result(timeout=2), [])
+        self.assertEqual(self.marketplace.cart_products(cart_id_2), [])
+
+    def test_shutdown_wakes_producers(self):
+        results = []
+        thread = Thread(target=lambda: results.append(
+            self.marketplace.wait_for_demand([self.product])))
+        thread.start()
+        thread.join(0.2)
+        self.assertTrue(thread.is_alive())
+
+        self.marketplace.shutdown()
+        thread.join(2)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(results, [None])
+        self.assertIsNone(self.marketplace.wait_for_demand([self.product]))
+        self.assertTrue(self.marketplace.is_shut_down())
+        self.assertFalse(self.marketplace.publish(self.producer_id, self.product))
+        self.assertEqual(self.marketplace.database['available_products'][self.producer_id], [])
+
+
+#Tests for cart changes racing an order
+
+class TestCartRaces(unittest.TestCase):
+    def setUp(self):
+        self.marketplace = Marketplace(5)
+        self.producer_id = self.marketplace.register_producer()
+        self.product = Product('product', 10)
+        self.marketplace.publish(self.producer_id, self.product)
+        self.cart_id = self.marketplace.new_cart()
+
+    def available(self):
+        return self.marketplace.database['available_products'][self.producer_id]
+
+    def test_add_racing_order(self):
+        #Testul tine lock_catalog, ca un add_to_cart aflat in mijlocul
+        #rezervarii; place_order trebuie sa astepte sfarsitul rezervarii
+        results = []
+        with self.marketplace.lock_catalog:
+            thread = Thread(target=lambda: results.append(
+                self.marketplace.place_order(self.cart_id)))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self.assertTrue(self.marketplace.add_to_cart(self.cart_id, self.product))
+        thread.join(2)
+        #Unitatea rezervata este vanduta, nu pierduta intr-un cos eliberat
+        self.assertEqual(results, [[self.product]])
+        self.assertEqual(self.available(), [])
+
+    def test_remove_racing_order(self):
+        #remove_from_cart este oprit la lock_catalog, comanda este plasata
+        #intre timp; dupa aceea el nu mai gaseste cosul
+        self.marketplace.add_to_cart(self.cart_id, self.product)
+        with self.marketplace.lock_catalog:
+            thread = Thread(target=self.marketplace.remove_from_cart,
+                            args=(self.cart_id, self.product))
+            thread.start()
+            thread.join(0.2)
+            order = self.marketplace.place_order(self.cart_id)
+        thread.join(2)
+        #Unitatea este vanduta si nu este in acelasi timp intoarsa in stoc
+        self.assertEqual(order, [self.product])
+        self.assertEqual(self.available(), [])
@@ -0,0 +1,121 @@
+from time import sleep
+import unittest
+
+#Tipul operatiei de cos care cumpara dupa o interogare de catalog in loc de
+#un produs anume: {"type": "add_cheapest", "query": {...}, "quantity": 2}
+ADD_CHEAPEST_OP = "add_cheapest"
+
+
+def plan_cart(operations):
+
+    #La fel ca in compute_expected_cart din test_generator, perechile de
+    #add / remove pe acelasi produs se reduc la cantitatea neta; produsele
+    #cu o cantitate neta <= 0 nu mai trebuie atinse deloc. Un remove se
+    #compenseaza doar cu add-urile explicite ale aceluiasi produs, nu si cu
+    #produsele alese de interogarile add_cheapest
+    plan = {}
+    for operation in operations:
+        if operation["type"] == ADD_CHEAPEST_OP:
+            continue
+        quantity = operation["quantity"]
+        if operation["type"] == "remove":
+            quantity = -quantity
+        plan[operation["product"]] = plan.get(operation["product"], 0) + quantity
+    return {product: quantity for product, quantity in plan.items() if quantity > 0}
+
+
+def plan_queries(operations):
+
+    #Interogarile raman separate, cu cantitatile lor, in ordinea din cos
+    return [[operation["query"], operation["quantity"]]
+            for operation in operations if operation["type"] == ADD_CHEAPEST_OP]
+
+
+def forecast_demand(carts, plan_carts=True):
+
+    #Cererea pe care o vor avea cosurile unui consumator, ca perechi
+    #[produs sau interogare, cantitate]: cantitatile nete ale planner-ului,
+    #sau fiecare add / add_cheapest cand operatiile se executa strict in ordine
+    demand = []
+    for operations in carts:
+        if plan_carts:
+            demand.extend([product, quantity] for product, quantity in plan_cart(operations).items())
+            demand.extend(plan_queries(operations))
+            continue
+        for operation in operations:
+            if operation["type"] == ADD_CHEAPEST_OP:
+                demand.append([operation["query"], operation["quantity"]])
+            elif operation["type"] != "remove":
+                demand.append([operation["product"], operation["quantity"]])
+    return demand
+
+
+def execute_plan(marketplace, identifier_cart, plan, retry_wait_time, queries=()):
+
+    #In loc sa ne blocam pe primul produs indisponibil, rezervam la fiecare
+    #trecere tot ce se gaseste din oricare produs (sau interogare) ramas si
+    #asteptam o singura data pentru tot ce inca lipseste
+    pending = dict(plan)
+    pending_queries = [list(query) for query in queries if query[1] > 0]
+    waits = 0
+    while pending or pending_queries:
+        for product in list(pending):
+            while pending[product] and marketplace.add_to_cart(identifier_cart, product):
+                pending[product] -= 1
+            if pending[product] == 0:
+                del pending[product]
+        for query in pending_queries:
+            while query[1] and marketplace.add_cheapest_to_cart(identifier_cart, query[0]) is not None:
+                query[1] -= 1
+        pending_queries = [query for query in pending_queries if query[1]]
+        if pending or pending_queries:
+            waits += 1
+            sleep(retry_wait_time)
+    return waits
+
+
+#Tests for the cart planner
+
+class TestPlanner(unittest.TestCase):
+    def test_plan_cart(self):
+        operations = [
+            {"type": "add", "product": "id1", "quantity": 3},
+            {"type": "add", "product": "id2", "quantity": 1},
+            {"type": "remove", "product": "id1", "quantity": 2},
+            {"type": "add", "product": "id3", "quantity": 1},
+            {"type": "remove", "product": "id3", "quantity": 1},
+        ]
+        self.assertEqual(plan_cart(operations), {"id1": 1, "id2": 1})
+
+        operations.append({"type": ADD_CHEAPEST_OP, "query": {"product_type": "Tea"},
+                           "quantity": 2})
+        self.assertEqual(plan_cart(operations), {"id1": 1, "id2": 1})
+        self.assertEqual(plan_queries(operations), [[{"product_type": "Tea"}, 2]])
+
+    def test_forecast_demand(self):
+        carts = [[{"type": "add", "product": "id1", "quantity": 3},
+                  {"type": "remove", "product": "id1", "quantity": 2}],
+                 [{"type": ADD_CHEAPEST_OP, "query": {"product_type": "Tea"}, "quantity": 2}]]
+        self.assertEqual(forecast_demand(carts), [["id1", 1], [{"product_type": "Tea"}, 2]])
+        self.assertEqual(forecast_demand(carts, plan_carts=False),
+                         [["id1", 3], [{"product_type": "Tea"}, 2]])
+
+    def test_execute_plan(self):
+        class FakeMarketplace:
+            def __init__(self):
+                self.stock = {"id1": 1, "id2": 0}
+                self.cart = []
+
+            def add_to_cart(self, identifier_cart, product):
+                if self.stock[product] == 0:
+                    #Produsul lipsa apare in stoc dupa prima incercare esuata
+                    self.stock[product] = 2
+                    return False
+                self.stock[product] -= 1
+                self.cart.append(product)
+                return True
+
+        marketplace = FakeMarketplace()
+        waits = execute_plan(marketplace, 0, {"id2": 2, "id1": 1}, 0)
+        self.assertEqual(sorted(marketplace.cart), ["id1", "id2", "id2"])
+        self.assertEqual(waits, 1)
@@ -3,17 +3,24 @@ from time import sleep
 
 class Producer(Thread):
 
-    def __init__(self, products, marketplace, republish_wait_time, **kwargs):
+    def __init__(self, products, marketplace, republish_wait_time, demand_driven=True, **kwargs):
         Thread.__init__(self, **kwargs)
         self.products = products
         self.marketplace = marketplace
         self.republish_wait_time = republish_wait_time
+        #Cu demand_driven, producatorul publica doar produsele cerute de
+        #consumatori si asteapta in marketplace cand nu exista cerere;
+        #altfel publica in bucla toate produsele, ca pana acum
+        self.demand_driven = demand_driven
         self.kwargs = kwargs
 
     def run(self):
 
         # Inregistram un nou producator in marketplace
         identifier_producer = self.marketplace.register_producer()
+        if self.demand_driven:
+            self.produce_on_demand(identifier_producer)
+            return
         while True:
             #Parcurgem toate produsele ce vor fi puse pe piata de
             #producatorul curent si incercam sa le punem.
@@ -31,5 +38,27 @@ class Producer(Thread):
                     if self.marketplace.publish(identifier_producer, identifier_product):
                         sleep(wait_time)
                     else:
+                        #Dupa shutdown-ul marketplace-ului producatorul se opreste
+                        if self.marketplace.is_shut_down():
+                            return
                         sleep(self.republish_wait_time)
                         break
+
+    def produce_on_demand(self, identifier_producer):
+
+        #La fiecare pas publicam cate o unitate din fiecare produs cerut,
+        #respectand timpul de productie al produsului; wait_for_demand
+        #intoarce None dupa shutdown
+        products = [current_product[0] for current_product in self.products]
+        while True:
+            wanted = self.marketplace.wait_for_demand(products)
+            if wanted is None:
+                return
+            for index in wanted:
+                identifier_product, _, wait_time = self.products[index]
+                if self.marketplace.publish(identifier_producer, identifier_product):
+                    sleep(wait_time)
+                elif self.marketplace.is_shut_down():
+                    return
+                else:
+                    sleep(self.republish_wait_time)
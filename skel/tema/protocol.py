@@ -0,0 +1,186 @@
+from dataclasses import fields
+import socket
+import struct
+
+from tema.product import Product, Tea, Coffee
+
+#Header-ul fiecarui cadru: lungimea payload-ului, id-ul cererii si codul
+#operatiei (pentru cereri) sau statusul (pentru raspunsuri)
+HEADER = struct.Struct('<IIB')
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+#Codurile operatiilor expuse de server, impreuna cu metoda din Marketplace
+#pe care o apeleaza
+REGISTER_PRODUCER = 1
+PUBLISH = 2
+NEW_CART = 3
+ADD_TO_CART = 4
+REMOVE_FROM_CART = 5
+PLACE_ORDER = 6
+ABANDON_CART = 7
+FIND_CHEAPEST = 8
+ADD_CHEAPEST_TO_CART = 9
+SUBMIT_ORDER = 10
+COMMIT_ORDERS = 11
+DECLARE_DEMAND = 12
+WAIT_FOR_DEMAND = 13
+IS_SHUT_DOWN = 14
+SHUTDOWN = 15
+
+OPERATIONS = {
+    REGISTER_PRODUCER: 'register_producer',
+    PUBLISH: 'publish',
+    NEW_CART: 'new_cart',
+    ADD_TO_CART: 'add_to_cart',
+    REMOVE_FROM_CART: 'remove_from_cart',
+    PLACE_ORDER: 'place_order',
+    ABANDON_CART: 'abandon_cart',
+    FIND_CHEAPEST: 'find_cheapest',
+    ADD_CHEAPEST_TO_CART: 'add_cheapest_to_cart',
+    SUBMIT_ORDER: 'submit_order',
+    COMMIT_ORDERS: 'commit_orders',
+    DECLARE_DEMAND: 'declare_demand',
+    WAIT_FOR_DEMAND: 'wait_for_demand',
+    IS_SHUT_DOWN: 'is_shut_down',
+    SHUTDOWN: 'shutdown',
+}
+OPCODES = {name: opcode for opcode, name in OPERATIONS.items()}
+
+#Clasele de produse care pot circula pe socket, identificate prin index
+PRODUCT_CLASSES = [Product, Tea, Coffee]
+PRODUCT_CLASS_INDEX = {product_class: index for index, product_class in enumerate(PRODUCT_CLASSES)}
+
+INT64 = struct.Struct('<q')
+DOUBLE = struct.Struct('<d')
+UINT32 = struct.Struct('<I')
+
+
+class MarketplaceError(Exception):
+    pass
+
+
+def parse_address(address):
+
+    #O adresa de forma host:port este TCP, orice altceva este calea
+    #unui socket Unix
+    host, separator, port = address.rpartition(':')
+    if separator and port.isdigit() and '/' not in address:
+        return socket.AF_INET, (host or 'localhost', int(port))
+    return socket.AF_UNIX, address
+
+
+def encode_value(value, out):
+
+    #Fiecare valoare este precedata de un octet care ii indica tipul,
+    #produsele fiind trimise ca index de clasa urmat de campurile lor
+    if value is None:
+        out += b'N'
+    elif value is True:
+        out += b'T'
+    elif value is False:
+        out += b'F'
+    elif isinstance(value, int):
+        out += b'i'
+        out += INT64.pack(value)
+    elif isinstance(value, float):
+        out += b'd'
+        out += DOUBLE.pack(value)
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        out += b's'
+        out += UINT32.pack(len(data))
+        out += data
+    elif isinstance(value, (list, tuple)):
+        out += b'l'
+        out += UINT32.pack(len(value))
+        for item in value:
+            encode_value(item, out)
+    elif isinstance(value, dict):
+        out += b'm'
+        out += UINT32.pack(len(value))
+        for key, item in value.items():
+            encode_value(key, out)
+            encode_value(item, out)
+    elif type(value) in PRODUCT_CLASS_INDEX:
+        out += b'p'
+        out.append(PRODUCT_CLASS_INDEX[type(value)])
+        for field in fields(value):
+            encode_value(getattr(value, field.name), out)
+    else:
+        raise MarketplaceError(f"Cannot encode value of type {type(value).__name__}")
+
+
+def decode_value(data, offset):
+
+    #Intoarce valoarea decodificata si pozitia de unde incepe urmatoarea
+    tag = data[offset:offset + 1]
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return INT64.unpack_from(data, offset)[0], offset + INT64.size
+    if tag == b'd':
+        return DOUBLE.unpack_from(data, offset)[0], offset + DOUBLE.size
+    if tag == b's':
+        length = UINT32.unpack_from(data, offset)[0]
+        offset += UINT32.size
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+    if tag == b'l':
+        count = UINT32.unpack_from(data, offset)[0]
+        offset += UINT32.size
+        items = []
+        for _ in range(count):
+            item, offset = decode_value(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == b'm':
+        count = UINT32.unpack_from(data, offset)[0]
+        offset += UINT32.size
+        items = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset)
+            items[key], offset = decode_value(data, offset)
+        return items, offset
+    if tag == b'p':
+        product_class = PRODUCT_CLASSES[data[offset]]
+        offset += 1
+        values = []
+        for _ in fields(product_class):
+            value, offset = decode_value(data, offset)
+            values.append(value)
+        return product_class(*values), offset
+    raise MarketplaceError(f"Unknown value tag {tag!r}")
+
+
+def encode_frame(request_id, code, value, out):
+
+    #Scriem payload-ul dupa un header rezervat, completat la final
+    #cu lungimea reala
+    start = len(out)
+    out += bytes(HEADER.size)
+    encode_value(value, out)
+    HEADER.pack_into(out, start, len(out) - start - HEADER.size, request_id, code)
+
+
+def decode_frames(buffer):
+
+    #Extrage toate cadrele complete din buffer si il scurteaza corespunzator;
+    #un cadru incomplet ramane in buffer pana la urmatorul recv
+    frames = []
+    offset = 0
+    while len(buffer) - offset >= HEADER.size:
+        length, request_id, code = HEADER.unpack_from(buffer, offset)
+        end = offset + HEADER.size + length
+        if len(buffer) < end:
+            break
+        value, _ = decode_value(buffer, offset + HEADER.size)
+        frames.append((request_id, code, value))
+        offset = end
+    del buffer[:offset]
+    return frames
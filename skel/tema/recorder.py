@@ -0,0 +1,339 @@
+from dataclasses import asdict
+from collections import deque
+from functools import wraps
+from itertools import count
+import json
+import os
+import struct
+import tempfile
+import unittest
+from threading import Lock, local, current_thread
+from time import perf_counter_ns
+
+from tema.product import Product, Tea, Coffee
+from tema.protocol import (REGISTER_PRODUCER, PUBLISH, NEW_CART, ADD_TO_CART,
+                           REMOVE_FROM_CART, PLACE_ORDER, ABANDON_CART,
+                           ADD_CHEAPEST_TO_CART, COMMIT_ORDERS, OPERATIONS)
+
+#Fiecare eveniment ocupa 40 de octeti: numarul de ordine global, momentul
+#inceperii si durata operatiei (ns), thread-ul, codul operatiei, rezultatul,
+#cosul, producatorul si indexul produsului
+EVENT = struct.Struct('<QQIHBbqii')
+MAGIC = b'MPTRACE1'
+HEADER_LENGTH = struct.Struct('<I')
+
+#Evenimente care nu sunt operatii ale marketplace-ului: cate un ORDER_ITEM
+#pentru fiecare produs vandut de place_order si cate un SNAPSHOT pe produs
+#la fiecare checkpoint (disponibil in campul producatorului, rezervat in
+#campul cosului). O operatie apelata din interiorul alteia (ex:
+#remove_from_cart din abandon_cart) are bitul NESTED setat in cod
+ORDER_ITEM = 64
+SNAPSHOT = 65
+NESTED = 0x80
+
+#Cate evenimente incap in bufferul unui thread inainte de a fi mutat in
+#lista de bucati deja completate
+EVENTS_PER_BUFFER = 4096
+
+PRODUCT_CLASSES = {product_class.__name__: product_class for product_class in [Product, Tea, Coffee]}
+
+
+class ThreadBuffer:
+
+    def __init__(self, thread_index):
+
+        self.thread_index = thread_index
+        self.buffer = bytearray(EVENTS_PER_BUFFER * EVENT.size)
+        self.position = 0
+        self.chunks = []
+        self.depth = 0
+        #Producatorul din/in care operatia curenta a mutat produsul
+        self.producer = -1
+        #Numerele de ordine luate de marketplace in sectiunile critice ale
+        #operatiilor in curs, consumate in ordine de record
+        self.sequences = deque()
+
+    def append(self, *event):
+
+        EVENT.pack_into(self.buffer, self.position, *event)
+        self.position += EVENT.size
+        if self.position == len(self.buffer):
+            self.chunks.append(bytes(self.buffer))
+            self.position = 0
+
+    def contents(self):
+        return b''.join(self.chunks) + bytes(self.buffer[:self.position])
+
+
+class Recorder:
+
+    def __init__(self):
+
+        #Fiecare thread scrie in propriul buffer; numarul de ordine global vine
+        #dintr-un contor partajat, astfel incat la final bufferele pot fi
+        #interclasate in ordinea in care s-au executat operatiile. Pentru ca
+        #ordinea numerelor sa fie chiar ordinea efectelor, marketplace-ul ia
+        #numarul prin note_effect in sectiunea critica a operatiei (ex: sub
+        #lock_catalog in add_to_cart), fara a serializa operatiile intre ele
+        self.sequence = count()
+        self.start = perf_counter_ns()
+        self.local = local()
+        self.lock = Lock()
+        self.buffers = []
+        self.thread_names = []
+        self.products = []
+        self.product_indexes = {}
+
+    def thread_buffer(self):
+
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            with self.lock:
+                buffer = ThreadBuffer(len(self.buffers))
+                self.buffers.append(buffer)
+                self.thread_names.append(current_thread().name)
+            self.local.buffer = buffer
+        return buffer
+
+    def product_index(self, product):
+
+        if product is None:
+            return -1
+        index = self.product_indexes.get(product)
+        if index is None:
+            with self.lock:
+                index = self.product_indexes.get(product)
+                if index is None:
+                    index = len(self.products)
+                    self.products.append(product)
+                    self.product_indexes[product] = index
+        return index
+
+    def note_effect(self, identifier_producer=None):
+
+        #Apelat de marketplace sub lock-ul care ordoneaza efectul operatiei
+        #curente: ia numarul ei de ordine si, cand un produs este luat de la
+        #(sau intors la) un producator, retine producatorul pentru ca
+        #evenimentul sa poata fi verificat pe perechea produs / producator
+        buffer = self.thread_buffer()
+        buffer.sequences.append(next(self.sequence))
+        if identifier_producer is not None:
+            buffer.producer = identifier_producer
+
+    def record(self, buffer, opcode, start, arguments, result):
+
+        #Traducem argumentele si rezultatul fiecarei operatii in campurile
+        #fixe ale evenimentului
+        end = perf_counter_ns()
+        identifier_cart = 0
+        identifier_producer = -1
+        product = None
+        outcome = -1
+        operation = opcode & ~NESTED
+        if operation == REGISTER_PRODUCER:
+            identifier_producer = result
+        elif operation == PUBLISH:
+            identifier_producer, product = arguments
+        elif operation == NEW_CART:
+            identifier_cart = result
+        elif operation in (ADD_TO_CART, REMOVE_FROM_CART):
+            identifier_cart, product = arguments
+            identifier_producer = buffer.producer
+        elif operation == PLACE_ORDER:
+            identifier_cart = arguments[0]
+            identifier_producer = len(result)
+        elif operation == ABANDON_CART:
+            identifier_cart = arguments[0]
+        elif operation == ADD_CHEAPEST_TO_CART:
+            #Se retine produsul gasit, astfel incat reluarea sa il poata
+            #rezerva direct; mutarea stocului apare in add_to_cart-ul imbricat
+            identifier_cart = arguments[0]
+            product = result
+            outcome = int(result is not None)
+        elif operation == COMMIT_ORDERS:
+            #Un lot este inregistrat ca cate un place_order pentru fiecare cos,
+            #astfel incat reluarea si verificarea stocului nu il deosebesc
+            for identifier_cart, order in zip(arguments[0], result):
+                self.record(buffer, PLACE_ORDER | (opcode & NESTED), start, [identifier_cart], order)
+            return
+        buffer.producer = -1
+        if isinstance(result, bool):
+            outcome = int(result)
+        #Operatiile fara un efect ordonat sub lock (ex: un cos inexistent)
+        #primesc numarul de ordine la terminare
+        sequence = buffer.sequences.popleft() if buffer.sequences else next(self.sequence)
+        buffer.append(sequence, start - self.start, min(end - start, 0xFFFFFFFF),
+                      buffer.thread_index, opcode, outcome, identifier_cart,
+                      identifier_producer, self.product_index(product))
+        if operation == PLACE_ORDER:
+            for product in result:
+                buffer.append(next(self.sequence), end - self.start, 0, buffer.thread_index,
+                              ORDER_ITEM, 1, identifier_cart, -1, self.product_index(product))
+
+    def snapshot(self, available, reserved):
+
+        #Inregistreaza, pentru fiecare produs, stocul observat direct in
+        #marketplace; comparat cu evenimentele de dinainte, el confirma ca
+        #nu s-a pierdut sau dublat niciun produs. Fiecare produs inregistrat
+        #primeste un rand, si cele ramase fara stoc, altfel o unitate pierduta
+        #din ultimul stoc al unui produs nu ar mai fi verificata
+        buffer = self.thread_buffer()
+        now = perf_counter_ns() - self.start
+        with self.lock:
+            products = list(self.products)
+        for product in set(products) | set(available) | set(reserved):
+            buffer.append(next(self.sequence), now, 0, buffer.thread_index, SNAPSHOT, -1,
+                          reserved.get(product, 0), available.get(product, 0),
+                          self.product_index(product))
+
+    def dump(self, path):
+
+        #Interclasam bufferele tuturor thread-urilor dupa numarul de ordine
+        #si scriem urma: antetul JSON (produse, thread-uri), apoi evenimentele
+        with self.lock:
+            data = b''.join(buffer.contents() for buffer in self.buffers)
+            header = {
+                'products': [dict(product_type=type(product).__name__, **asdict(product))
+                             for product in self.products],
+                'threads': list(self.thread_names),
+            }
+        events = sorted(EVENT.iter_unpack(data))
+        encoded_header = json.dumps(header).encode('utf-8')
+        with open(path, 'wb') as trace_file:
+            trace_file.write(MAGIC)
+            trace_file.write(HEADER_LENGTH.pack(len(encoded_header)))
+            trace_file.write(encoded_header)
+            for event in events:
+                trace_file.write(EVENT.pack(*event))
+        return len(events)
+
+
+def recorded(opcode):
+
+    #Decoratorul inregistreaza apelul doar daca marketplace-ul are un
+    #recorder atasat; altfel costul este o simpla verificare de atribut
+    def decorator(method):
+
+        @wraps(method)
+        def wrapper(marketplace, *arguments):
+            recorder = marketplace.recorder
+            if recorder is None:
+                return method(marketplace, *arguments)
+            buffer = recorder.thread_buffer()
+            if buffer.depth:
+                return record_call(recorder, buffer, opcode | NESTED, method, marketplace, arguments)
+            return record_call(recorder, buffer, opcode, method, marketplace, arguments)
+
+        return wrapper
+
+    return decorator
+
+
+def record_call(recorder, buffer, opcode, method, marketplace, arguments):
+
+    #Numerele de ordine ramase neconsumate (ex: dupa o exceptie) sunt
+    #aruncate la sfarsitul operatiei de pe primul nivel
+    buffer.depth += 1
+    start = perf_counter_ns()
+    try:
+        result = method(marketplace, *arguments)
+    except BaseException:
+        buffer.depth -= 1
+        if not buffer.depth:
+            buffer.sequences.clear()
+        raise
+    buffer.depth -= 1
+    recorder.record(buffer, opcode, start, arguments, result)
+    if not buffer.depth:
+        buffer.sequences.clear()
+    return result
+
+
+def load_trace(path):
+
+    #Intoarce antetul (cu produsele reconstruite) si lista de evenimente
+    with open(path, 'rb') as trace_file:
+        data = trace_file.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a marketplace trace")
+    offset = len(MAGIC)
+    header_length = HEADER_LENGTH.unpack_from(data, offset)[0]
+    offset += HEADER_LENGTH.size
+    header = json.loads(data[offset:offset + header_length].decode('utf-8'))
+    offset += header_length
+
+    products = []
+    for description in header['products']:
+        params = {k: v for k, v in description.items() if k != 'product_type'}
+        products.append(PRODUCT_CLASSES[description['product_type']](**params))
+    header['products'] = products
+    return header, list(EVENT.iter_unpack(data[offset:]))
+
+
+def replayable(events):
+
+    #Doar operatiile apelate direct de clienti se reiau; cele imbricate si
+    #evenimentele ORDER_ITEM / SNAPSHOT sunt doar pentru verificare
+    return [event for event in events if event[4] in OPERATIONS]
+
+
+def operation_name(opcode):
+
+    if opcode & NESTED:
+        return operation_name(opcode & ~NESTED) + ' (nested)'
+    return {ORDER_ITEM: 'order_item', SNAPSHOT: 'snapshot'}.get(opcode, OPERATIONS.get(opcode, str(opcode)))
+
+
+#Tests for the recorder
+
+class TestRecorder(unittest.TestCase):
+    def test_dump_and_load(self):
+        from tema.marketplace import Marketplace
+
+        recorder = Recorder()
+        marketplace = Marketplace(5, recorder=recorder)
+        product = Tea('Linden', 9, 'Herbal')
+        producer_id = marketplace.register_producer()
+        marketplace.publish(producer_id, product)
+        cart_id = marketplace.new_cart()
+        marketplace.add_to_cart(cart_id, product)
+        marketplace.add_to_cart(cart_id, product)
+        marketplace.abandon_cart(cart_id)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.bin')
+            self.assertEqual(recorder.dump(path), 7)
+            header, events = load_trace(path)
+
+        self.assertEqual(header['products'], [product])
+        self.assertEqual([event[0] for event in events], list(range(7)))
+        self.assertEqual([event[4] for event in events],
+                         [REGISTER_PRODUCER, PUBLISH, NEW_CART, ADD_TO_CART, ADD_TO_CART,
+                          REMOVE_FROM_CART | NESTED, ABANDON_CART])
+        self.assertEqual([event[5] for event in events], [-1, 1, -1, 1, 0, -1, 1])
+        self.assertEqual(events[3][7], producer_id)
+        self.assertEqual(len(replayable(events)), 6)
+
+    def test_snapshot_covers_sold_out_products(self):
+        from tema.marketplace import Marketplace
+
+        recorder = Recorder()
+        marketplace = Marketplace(5, recorder=recorder)
+        linden, mint = Tea('Linden', 9, 'Herbal'), Tea('Mint', 4, 'Herbal')
+        producer_id = marketplace.register_producer()
+        marketplace.publish(producer_id, linden)
+        marketplace.publish(producer_id, mint)
+        cart_id = marketplace.new_cart()
+        marketplace.add_to_cart(cart_id, mint)
+        marketplace.place_order(cart_id)
+        marketplace.checkpoint()
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'trace.bin')
+            recorder.dump(path)
+            header, events = load_trace(path)
+
+        #Produsul vandut complet apare in checkpoint cu stoc zero
+        snapshots = {header['products'][event[8]]: (event[7], event[6])
+                     for event in events if event[4] == SNAPSHOT}
+        self.assertEqual(snapshots, {linden: (1, 0), mint: (0, 0)})
@@ -0,0 +1,175 @@
+import os
+import socket
+import socketserver
+import sys
+from concurrent.futures import Future
+import tempfile
+import unittest
+from threading import Thread
+
+from tema.marketplace import Marketplace
+from tema.client import MarketplaceClient
+from tema.product import Tea, Coffee
+from tema.protocol import (OPERATIONS, STATUS_OK, STATUS_ERROR, MarketplaceError,
+                           parse_address, encode_frame, decode_frames)
+
+
+class MarketplaceRequestHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        # Fiecare conexiune primeste cereri in rafale: tot ce a sosit intr-un
+        # recv este procesat in ordine, iar raspunsurile sunt trimise impreuna
+        # printr-un singur sendall. Astfel un client care trimite mai multe
+        # cereri fara sa astepte raspunsul (pipelining) plateste un singur
+        # drum dus-intors pentru tot lotul
+        marketplace = self.server.marketplace
+        if self.request.family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buffer = bytearray()
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                break
+            buffer += data
+            responses = bytearray()
+            for request_id, opcode, arguments in decode_frames(buffer):
+                try:
+                    operation = OPERATIONS.get(opcode)
+                    if operation is None:
+                        raise MarketplaceError(f"Unknown operation {opcode}")
+                    result = getattr(marketplace, operation)(*arguments)
+                    #Operatiile asincrone (submit_order) raspund cand sunt gata
+                    if isinstance(result, Future):
+                        result = result.result()
+                    encode_frame(request_id, STATUS_OK, result, responses)
+                except Exception as thrown_exception:
+                    encode_frame(request_id, STATUS_ERROR, thrown_exception.__str__(), responses)
+            if responses:
+                self.request.sendall(responses)
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MarketplaceServer:
+
+    def __init__(self, marketplace, address):
+
+        self.marketplace = marketplace
+        self.address = address
+        family, server_address = parse_address(address)
+        if family == socket.AF_UNIX:
+            #Un socket ramas de la o rulare anterioara ar bloca bind-ul
+            if os.path.exists(server_address):
+                os.unlink(server_address)
+            self.server = ThreadingUnixServer(server_address, MarketplaceRequestHandler)
+        else:
+            self.server = ThreadingTCPServer(server_address, MarketplaceRequestHandler)
+        self.server.marketplace = marketplace
+        self.family = family
+        self.server_address = server_address
+        self.thread = None
+
+    def start(self):
+
+        #Pornim bucla serverului pe un thread separat, pentru a putea rula
+        #producatorii si consumatorii in acelasi proces (ex: test.py)
+        self.thread = Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def stop(self):
+
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread.join()
+            self.thread = None
+        self.server.server_close()
+        if self.family == socket.AF_UNIX and os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def main():
+
+    #Utilizare: python3 -m tema.server ADRESA [queue_size_per_producer]
+    #unde ADRESA este calea unui socket Unix sau host:port pentru TCP
+    if len(sys.argv) < 2:
+        print("usage: python3 -m tema.server address [queue_size_per_producer]")
+        raise SystemExit
+    queue_size = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = MarketplaceServer(Marketplace(queue_size), sys.argv[1])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+#Tests for the marketplace server
+
+class TestMarketplaceServer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        address = os.path.join(self.directory.name, 'marketplace.sock')
+        self.server = MarketplaceServer(Marketplace(5), address).start()
+        self.client = MarketplaceClient(address)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.stop()
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        product = Coffee('Arabica', 10, 5.05, 'MEDIUM')
+        producer_id = self.client.register_producer()
+        self.assertTrue(self.client.publish(producer_id, product))
+
+        cart_id = self.client.new_cart()
+        self.assertTrue(self.client.add_to_cart(cart_id, product))
+        self.assertFalse(self.client.add_to_cart(cart_id, product))
+        self.assertEqual(self.client.place_order(cart_id), [product])
+
+    def test_pipeline(self):
+        product = Tea('Linden', 9, 'Herbal')
+        producer_id = self.client.register_producer()
+        with self.client.pipeline() as pipeline:
+            for _ in range(3):
+                pipeline.publish(producer_id, product)
+            pipeline.new_cart()
+        self.assertEqual(pipeline.results, [True, True, True, 0])
+
+        with self.client.pipeline() as pipeline:
+            pipeline.add_to_cart(0, product)
+            pipeline.add_to_cart(0, product)
+            pipeline.remove_from_cart(0, product)
+            pipeline.place_order(0)
+        self.assertEqual(pipeline.results, [True, True, None, [product]])
+
+    def test_query(self):
+        cheap = Tea('Milky Oolong', 3, 'Oolong')
+        producer_id = self.client.register_producer()
+        self.client.publish(producer_id, Tea('China Oolong', 7, 'Oolong'))
+        self.client.publish(producer_id, cheap)
+
+        query = {"product_type": "Tea", "type": "Oolong", "max_price": 5}
+        self.assertEqual(self.client.find_cheapest(query), cheap)
+        cart_id = self.client.new_cart()
+        self.assertEqual(self.client.add_cheapest_to_cart(cart_id, query), cheap)
+        self.assertIsNone(self.client.add_cheapest_to_cart(cart_id, query))
+        with self.assertRaises(MarketplaceError):
+            self.client.add_cheapest_to_cart(cart_id, {"product_type": "Juice"})
+        self.assertEqual(self.client.place_order(cart_id), [cheap])
+
+
+if __name__ == '__main__':
+    main()
@@ -6,12 +6,16 @@ Assignment 1
 March 2020
 """
 
-import sys
-from json import loads
+import argparse
+from json import dumps, loads
 
 from tema.producer import Producer
 from tema.consumer import Consumer
 from tema.marketplace import Marketplace
+from tema.catalog import Catalog
+from tema.server import MarketplaceServer
+from tema.client import MarketplaceClient
+from tema.recorder import Recorder
 from tema.product import Product, Coffee, Tea
 
 
@@ -19,13 +23,30 @@ def main():
     """
         Convert the market_configuration input file into specific models:
         Producer, Consumer, Marketplace
+
+        An optional second argument (a Unix socket path or host:port) serves
+        the marketplace on that address and points producers and consumers
+        at it through a MarketplaceClient. --record TRACE writes every
+        marketplace operation to a trace that replay.py can re-drive.
+        --strict runs every cart operation in order instead of through the
+        cart planner, and --blocked FILE writes each consumer's per-cart
+        blocked times (see bench_carts.py).
     """
-    try:
-        filename = sys.argv[1]
-    except IndexError:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('filename', nargs='?')
+    parser.add_argument('address', nargs='?')
+    parser.add_argument('--record', metavar='TRACE')
+    parser.add_argument('--strict', action='store_true')
+    parser.add_argument('--blocked', metavar='FILE')
+    arguments = parser.parse_args()
+
+    filename = arguments.filename
+    if filename is None:
         print("no input file specified")
         raise SystemExit
 
+    address = arguments.address
+
     with open(filename) as input_file:
         market_config = loads(input_file.read())
 
@@ -44,23 +65,40 @@ def main():
                                 in producer['products']]
 
     # turn product ids into products in consumer order lists and expected carts
+    catalog = Catalog()
     for consumer in market_config['consumers']:
         for cart in consumer['carts']:
             for operation in cart:
-                operation['product'] = products[operation['product']]
+                # add_cheapest operations carry a catalog query, not a product id;
+                # an invalid query is rejected here instead of failing in a consumer
+                if 'product' in operation:
+                    operation['product'] = products[operation['product']]
+                else:
+                    try:
+                        catalog.parse_query(operation['query'])
+                    except ValueError as error:
+                        raise SystemExit(f"{filename}: invalid query {operation['query']}: {error}")
 
     # build the marketplace
-    marketplace = Marketplace(**market_config['marketplace'])
+    recorder = Recorder() if arguments.record else None
+    marketplace = Marketplace(**market_config['marketplace'], recorder=recorder)
+
+    server = None
+    if address is not None:
+        server = MarketplaceServer(marketplace, address).start()
+        marketplace = MarketplaceClient(address)
+    engine = server.marketplace if server is not None else marketplace
 
     # build and start the producers
-    producers = [Producer(**p_market_config, marketplace=marketplace, daemon=True)
+    producers = [Producer(**p_market_config, marketplace=marketplace)
                  for p_market_config in market_config['producers']]
 
     for producer in producers:
         producer.start()
 
     # build and start the consumers
-    consumers = [Consumer(**c_market_config, marketplace=marketplace)
+    consumers = [Consumer(**c_market_config, marketplace=marketplace,
+                          plan_carts=not arguments.strict)
                  for c_market_config in market_config['consumers']]
 
     for consumer in consumers:
@@ -69,6 +107,23 @@ def main():
     for consumer in consumers:
         consumer.join()
 
+    # once every consumer is done, stop the producers
+    marketplace.shutdown()
+    for producer in producers:
+        producer.join()
+
+    if server is not None:
+        server.stop()
+
+    if recorder is not None:
+        engine.checkpoint()
+        recorder.dump(arguments.record)
+
+    if arguments.blocked is not None:
+        with open(arguments.blocked, 'w') as blocked_file:
+            blocked_file.write(dumps({consumer.name: consumer.blocked_times
+                                      for consumer in consumers}))
+
 
 if __name__ == '__main__':
     main()